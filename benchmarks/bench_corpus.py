@@ -0,0 +1,128 @@
+"""
+Benchmark each stage of building a TeamworkCorpus on synthetic notes.
+
+Times and memory-profiles (peak traced allocation) the stages:
+_prepare_note_data, _get_edge_data, _get_team_data, the dictionary build of
+TeamworkCorpus.__build_dicts, loading a saved corpus (TeamworkCorpus.load,
+and pickle.loads for comparison), per-visit graph building, and the metrics
+of teamwork_utils (get_output_for_row via get_outputs, and get_output_df).
+
+Usage:
+    python benchmarks/bench_corpus.py                  # 10k, 100k and 1M visits
+    python benchmarks/bench_corpus.py --visits 10000 --no-memory
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from teamwork import teamwork as tw
+from teamwork import teamwork_utils as tu
+from teamwork import synthetic
+
+
+class StageTimer:
+    '''
+    Records the wall time and peak traced memory of benchmark stages
+    '''
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def run(self, stage, n_visits, func, *args):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak_mb = np.nan
+        if self.trace_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.results.append(
+            {"visits": n_visits, "stage": stage, "seconds": seconds, "peak_mb": peak_mb}
+        )
+        print(f"{n_visits:>9} {stage:<28} {seconds:9.3f}s {peak_mb:10.1f} MB")
+        return result
+
+
+def bench_corpus(n_visits, timer, n_authors, metric_visits, seed):
+    columns = dict(tw.default_columns)
+    teamwork_delta = np.timedelta64(90, "D")
+    team_delta = timedelta(days=2)
+    notes_df = synthetic.generate_notes(
+        n_visits, n_authors=n_authors, days=max(365, n_visits // 100), seed=seed
+    )
+
+    first_date = notes_df[columns[tw.ADMISSION_DATE]].min()
+    first_day = np.datetime64(first_date, "D")
+    (authors, visit_ids) = timer.run(
+        "_prepare_note_data", n_visits, tw._prepare_note_data, notes_df, columns, team_delta,
+        first_day,
+    )
+    edge_df = timer.run(
+        "_get_edge_data", n_visits, tw._get_edge_data, notes_df, columns, teamwork_delta, first_date
+    )
+    team_df = timer.run(
+        "_get_team_data", n_visits, tw._get_team_data, notes_df, columns, teamwork_delta, first_date
+    )
+
+    def build_dicts():
+        # the same steps as TeamworkCorpus.__build_dicts
+        edge_to_date_dict = tw._build_edge_timelines(edge_df, first_day)
+        dx_edge_to_date_dict = tw._build_edge_timelines(
+            edge_df[edge_df[columns[tw.TEAM_CONDITION]]], first_day
+        )
+        team_dicts = tw._build_team_dicts(team_df, authors, visit_ids, first_day)
+        return edge_to_date_dict, dx_edge_to_date_dict, team_dicts
+
+    timer.run("__build_dicts", n_visits, build_dicts)
+
+    # per-visit stages run on a sample of visits, so large corpora stay tractable
+    sample_df = notes_df[notes_df[columns[tw.VISIT_ID]] < metric_visits]
+    corpus = tw.TeamworkCorpus(sample_df[[*columns.values()]], cache_size=0)
+    with tempfile.TemporaryDirectory() as path:
+        corpus.save(os.path.join(path, "index"))
+        timer.run(
+            "TeamworkCorpus.load", n_visits, tw.TeamworkCorpus.load,
+            os.path.join(path, "index"), 0,
+        )
+    timer.run("pickle.loads", n_visits, pickle.loads, pickle.dumps(corpus))
+    timer.run("graph building", n_visits, corpus.materialize_team_experience)
+    prov_demo_dict = synthetic.generate_prov_demo_dict(corpus.authors, seed=seed)
+    dept_dict = synthetic.generate_dept_dict(corpus.visit_ids, seed=seed)
+    timer.run("get_output_for_row", n_visits, tu.get_outputs, corpus, dept_dict, prov_demo_dict)
+    timer.run("get_output_df", n_visits, tu.get_output_df, corpus, dept_dict, prov_demo_dict)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--visits", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+        help="corpus sizes, in visits",
+    )
+    parser.add_argument("--authors", type=int, default=2000, help="number of note authors")
+    parser.add_argument(
+        "--metric-visits", type=int, default=10_000,
+        help="visits sampled for the per-visit graph and metrics stages",
+    )
+    parser.add_argument("--no-memory", action="store_true", help="skip memory tracing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this CSV file")
+    args = parser.parse_args()
+
+    timer = StageTimer(trace_memory=not args.no_memory)
+    for n_visits in args.visits:
+        bench_corpus(n_visits, timer, args.authors, args.metric_visits, args.seed)
+    if args.output:
+        pd.DataFrame(timer.results).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,11 @@ setup(
         'numpy',
         'networkx'
     ], 
+    extras_require={  # Optional
+        'parquet': ['pyarrow'],
+        'polars': ['polars', 'pyarrow'],
+        'duckdb': ['duckdb'],
+    },
     project_urls={  # Optional
         'Source': 'https://github.com/gtdelong/teamwork/',
     },
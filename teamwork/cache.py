@@ -0,0 +1,272 @@
+"""
+cache
+-----
+Content-addressed on-disk cache of teamwork results, for analyses that are
+rerun with the same notes extract and parameters.
+
+Every entry is keyed on a fingerprint of its inputs: a hash of the notes
+(the file contents, or the corpus columns of a DataFrame), the column
+mapping, the windows and the conditions, and for metrics the department
+and provider dictionaries. The keys also hold the version of the stored
+format (INDEX_VERSION for the corpus, NOTES_VERSION and METRICS_VERSION
+for the others). A changed input or format gives a new key, so stale
+entries are never read; they are evicted, least recently used first, once
+the cache is over its size limit.
+"""
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import logging
+import pandas as pd
+
+from teamwork.teamwork import (
+    TeamworkCorpus,
+    default_columns,
+    ADMISSION_DATE,
+    NOTE_DATE,
+    INDEX_VERSION,
+    _as_note_dates,
+    _get_note_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    '''
+    On-disk cache of the stages of a teamwork analysis, in the directory path:
+
+    - "notes": the note columns read from a notes file (CSV or Parquet),
+      as parsed; the corpus prepares them again on every build,
+    - "corpus": the corpus indexes, i.e. the edge timelines and team edges
+      (see TeamworkCorpus.save),
+    - "metrics": the output of teamwork_utils.get_output_df.
+
+    A stage is reused if its inputs are unchanged, and only the missing
+    stages are computed. Entries are evicted, least recently used first,
+    when the cache holds more than max_bytes. invalidate removes entries
+    explicitly.
+    '''
+    def __init__(self, path, max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def get_corpus(
+        self,
+        notes,
+        teamwork_window=90,
+        team_window=2,
+        first_date=None,
+        conditions=None,
+        verbose=True,
+        **columns,
+    ):
+        '''
+        TeamworkCorpus of notes, a DataFrame or the name of a notes CSV or
+        Parquet file, loaded from the cache if it was built before with the
+        same notes and parameters. A loaded corpus has no notes, edge or team
+        tables (see TeamworkCorpus.load).
+
+        The corpus has the key of its cache entry as fingerprint, to cache
+        its metrics with get_output_df.
+        '''
+        columns = {**default_columns, **columns}
+        note_columns = _get_note_columns(columns, conditions)
+        if isinstance(notes, pd.DataFrame):
+            notes_key = _hash_parts(
+                NOTES_VERSION, "frame", fingerprint_notes(notes, note_columns)
+            )
+        else:
+            notes_key = _hash_parts(
+                NOTES_VERSION, "file", fingerprint_file(notes), note_columns
+            )
+        key = _hash_parts(
+            INDEX_VERSION,
+            notes_key,
+            columns,
+            teamwork_window,
+            team_window,
+            first_date,
+            conditions,
+        )
+        entry = self.__get_entry("corpus", key)
+        if entry is not None:
+            corpus = TeamworkCorpus.load(entry, verbose=verbose)
+        else:
+            if isinstance(notes, pd.DataFrame):
+                notes_df = notes
+            else:
+                notes_df = self.__get_notes(notes_key, notes, note_columns, columns)
+            corpus = TeamworkCorpus(
+                notes_df,
+                teamwork_window,
+                team_window,
+                first_date,
+                verbose=verbose,
+                conditions=conditions,
+                **columns,
+            )
+            self.__put("corpus", key, corpus.save)
+        corpus.fingerprint = key
+        return corpus
+
+    def get_output_df(self, corpus, dept_dict, prov_demo_dict):
+        '''
+        teamwork_utils.get_output_df of a corpus of get_corpus, read from the
+        cache if it was computed before with the same dictionaries
+        '''
+        from teamwork import teamwork_utils as tu
+
+        if getattr(corpus, "fingerprint", None) is None:
+            raise ValueError(
+                "the corpus was not built by ResultCache.get_corpus, "
+                "or notes were added to it since"
+            )
+        key = _hash_parts(
+            METRICS_VERSION,
+            corpus.fingerprint,
+            hashlib.sha256(pickle.dumps(dept_dict, protocol=4)).hexdigest(),
+            hashlib.sha256(pickle.dumps(prov_demo_dict, protocol=4)).hexdigest(),
+        )
+        entry = self.__get_entry("metrics", key)
+        if entry is not None:
+            return pd.read_pickle(os.path.join(entry, METRICS_FILE))
+        output_df = tu.get_output_df(corpus, dept_dict, prov_demo_dict)
+        self.__put(
+            "metrics", key, lambda path: _write_pickle(output_df, path, METRICS_FILE)
+        )
+        return output_df
+
+    def invalidate(self, stage=None):
+        '''
+        Remove the entries of a stage ("notes", "corpus" or "metrics"),
+        or every entry
+        '''
+        for name in self.__entries():
+            if stage is None or name.startswith(f"{stage}-"):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def size(self):
+        '''
+        Bytes held by the cache entries
+        '''
+        return sum(_get_dir_size(os.path.join(self.path, name)) for name in self.__entries())
+
+    def __get_notes(self, key, filename, note_columns, columns):
+        entry = self.__get_entry("notes", key)
+        if entry is not None:
+            return pd.read_pickle(os.path.join(entry, NOTES_FILE))
+        if str(filename).endswith(".parquet"):
+            notes_df = pd.read_parquet(filename, columns=note_columns)
+            notes_df = _as_note_dates(notes_df, columns)
+        else:
+            notes_df = pd.read_csv(
+                filename,
+                parse_dates=[columns[ADMISSION_DATE], columns[NOTE_DATE]],
+                usecols=note_columns,
+            )
+        self.__put("notes", key, lambda path: _write_pickle(notes_df, path, NOTES_FILE))
+        return notes_df
+
+    def __get_entry(self, stage, key):
+        '''
+        Directory of the entry of stage and key, or None on a miss. A hit
+        marks the entry as recently used.
+        '''
+        entry = os.path.join(self.path, f"{stage}-{key}")
+        if not os.path.isdir(entry):
+            logger.debug("cache miss: %s %s", stage, key)
+            return None
+        logger.debug("cache hit: %s %s", stage, key)
+        os.utime(entry)
+        return entry
+
+    def __put(self, stage, key, write):
+        '''
+        Add an entry, written by write(directory) to a temporary directory
+        that is then renamed, and evict entries over max_bytes
+        '''
+        entry = os.path.join(self.path, f"{stage}-{key}")
+        tmp_entry = f"{entry}.tmp-{os.getpid()}"
+        write(tmp_entry)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # written by another process in the meantime
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.__evict(keep=entry)
+
+    def __evict(self, keep):
+        entries = [os.path.join(self.path, name) for name in self.__entries()]
+        entries.sort(key=os.path.getmtime)
+        sizes = {entry: _get_dir_size(entry) for entry in entries}
+        total = sum(sizes.values())
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry != keep:
+                logger.debug("cache evict: %s", entry)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= sizes[entry]
+
+    def __entries(self):
+        return [
+            name
+            for name in os.listdir(self.path)
+            if ".tmp-" not in name and os.path.isdir(os.path.join(self.path, name))
+        ]
+
+
+def fingerprint_notes(notes_df, columns):
+    '''
+    Hash of the values, names and dtypes of the given columns of a notes
+    DataFrame; the index and the other columns are ignored
+    '''
+    notes_df = notes_df[[*columns]]
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[*columns], [str(t) for t in notes_df.dtypes]]).encode())
+    digest.update(pd.util.hash_pandas_object(notes_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint_file(filename, block_size=2**20):
+    '''
+    Hash of the contents of a file
+    '''
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_parts(*parts):
+    '''
+    Hash of JSON-serializable parts (dates and other values as strings)
+    '''
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _write_pickle(df, path, filename):
+    os.makedirs(path, exist_ok=True)
+    df.to_pickle(os.path.join(path, filename))
+
+
+def _get_dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for (root, _, names) in os.walk(path)
+        for name in names
+    )
+
+
+NOTES_FILE = "notes.pkl"
+METRICS_FILE = "metrics.pkl"
+# versions of the stored notes and metrics; bump on a change of their layout
+NOTES_VERSION = 1
+METRICS_VERSION = 1
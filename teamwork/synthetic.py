@@ -0,0 +1,97 @@
+"""
+synthetic
+---------
+Synthetic clinical note corpora for testing and benchmarking teamwork.
+
+Authors are split into services, and each visit draws its note authors
+mostly from one service, so that pairs of authors collaborate repeatedly
+over time, as in a real hospital.
+"""
+import numpy as np
+import pandas as pd
+
+from teamwork.teamwork import default_columns, VISIT_ID, ADMISSION_DATE, NOTE_DATE, NOTE_AUTHOR, TEAM_CONDITION
+
+
+def generate_notes(
+    n_visits=1000,
+    n_authors=200,
+    notes_per_visit=8,
+    stay_length=4,
+    dx_prevalence=0.3,
+    days=365,
+    start_date="2019-01-01",
+    n_services=10,
+    seed=None,
+    **columns,
+):
+    '''
+    Generate a notes DataFrame with the columns expected by TeamworkCorpus.
+
+    - n_visits: number of patient visits, admitted uniformly over days
+    - n_authors: number of note authors, split into n_services services
+    - notes_per_visit: mean number of notes per visit (Poisson, at least 1)
+    - stay_length: mean length of stay in days (exponential); notes are
+      written uniformly over the stay
+    - dx_prevalence: share of visits with the team condition
+    - seed: seed of the random generator, for reproducible corpora
+
+    Rows are sorted by note date.
+    '''
+    columns = {**default_columns, **columns}
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(pd.Timestamp(start_date), "m")
+    minutes_per_day = 24 * 60
+
+    admit_dates = start + rng.integers(0, days * minutes_per_day, n_visits).astype(
+        "timedelta64[m]"
+    )
+    stays = rng.exponential(stay_length, n_visits) * minutes_per_day
+    services = rng.integers(0, n_services, n_visits)
+    has_dx = rng.random(n_visits) < dx_prevalence
+
+    n_notes = np.maximum(rng.poisson(notes_per_visit, n_visits), 1)
+    visits = np.repeat(np.arange(n_visits), n_notes)
+    note_dates = admit_dates[visits] + (
+        rng.random(len(visits)) * stays[visits]
+    ).astype("timedelta64[m]")
+
+    # most notes come from the visit's service, the rest from any service
+    service_size = max(n_authors // n_services, 1)
+    authors = services[visits] * service_size + rng.integers(0, service_size, len(visits))
+    is_consult = rng.random(len(visits)) < 0.2
+    authors[is_consult] = rng.integers(0, n_authors, is_consult.sum())
+    authors = np.minimum(authors, n_authors - 1)
+
+    notes_df = pd.DataFrame(
+        {
+            columns[VISIT_ID]: visits,
+            columns[ADMISSION_DATE]: admit_dates[visits],
+            columns[NOTE_DATE]: note_dates,
+            columns[NOTE_AUTHOR]: np.char.add("author_", authors.astype(str)).astype(object),
+            columns[TEAM_CONDITION]: has_dx[visits],
+        }
+    )
+    return notes_df.sort_values(columns[NOTE_DATE], kind="stable", ignore_index=True)
+
+
+def generate_prov_demo_dict(authors, seed=None):
+    '''
+    Provider demographics in the format of teamwork_utils.get_prov_demo_dict,
+    with random recorded and guessed sex, for the given authors
+    '''
+    rng = np.random.default_rng(seed)
+    sexes = rng.choice(["F", "M", "U"], size=(len(authors), 2), p=[0.45, 0.45, 0.1])
+    return {
+        author: {"sex": sex, "guessed_sex": sex if sex != "U" else guessed_sex}
+        for (author, (sex, guessed_sex)) in zip(authors, sexes)
+    }
+
+
+def generate_dept_dict(visit_ids, n_depts=5, seed=None):
+    '''
+    Visit departments in the format of teamwork_utils.get_dept_dict
+    '''
+    rng = np.random.default_rng(seed)
+    depts = rng.integers(0, n_depts, len(visit_ids))
+    return {int(visit_id): {"dept": f"dept_{dept}"} for (visit_id, dept) in zip(visit_ids, depts)}
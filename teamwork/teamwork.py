@@ -8,14 +8,29 @@ The intuition is that providers who wrote clinical notes on
 the same patient, within a given time frame, have collaborated and
 have gained experience working together as part of the care team.
 """
+import os
+import sys
+import json
+import time
+import logging
+import multiprocessing
 import pandas as pd
 import networkx as nx
 import numpy as np
 from tqdm import tqdm
 from datetime import timedelta
+from collections import namedtuple, OrderedDict
+from collections.abc import Mapping
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
+logger = logging.getLogger(__name__)
+
 
 class TeamworkCorpus:
     """
@@ -33,112 +48,1347 @@ class TeamworkCorpus:
     - the team member's notes are written within a specified window after the 
     hospital admission. Default is 48 hours.
     - the patient's visit relates to a specified diagnosis/condition (e.g. heart failure)
+
+    The start of the corpus defaults to the first admission date, and can be
+    set with first_date (e.g. when the notes are a slice of a larger corpus).
+
+    The team experience of a visit is computed the first time it is read from
+    team_experience_dict, and the last cache_size visits read are kept
+    (None keeps every visit). Use materialize_team_experience to compute
+    every visit at once.
+
+    Batch work over every visit (materialize_team_experience, map_visits)
+    is sharded across n_jobs worker processes (-1 for one per CPU).
+
+    With graph_type="adjacency", team graphs are lightweight TeamGraphs
+    (with to_networkx and to_scipy converters) instead of networkx Graphs.
+
+    teamwork_window can also be a list of windows (e.g. [30, 90, 365]), to
+    weight every team edge by its experience in each window from the same
+    edge timelines. The team edges then carry a weight_<window> attribute
+    (or edgelist column) per window, and weight is the weight in the first
+    window; the graphs keep the edges with a positive weight in any window.
+    Visits must be admitted more than the longest window after the start
+    of the corpus.
+
+    conditions adds diagnosis cohorts besides team_condition: a list of
+    boolean columns, or the name of a categorical column whose values are
+    the conditions. The condition experience of every edge is kept in one
+    timeline dictionary, with a count per condition for each day, and the
+    team experience has a dx graph and edgelist per condition
+    (condition_graphs and condition_edgelists).
+
+    The wall time, row count and peak RSS of each build stage are recorded
+    in stats, a dict of stage name to StageStats. Each record is also logged
+    at DEBUG level and passed to on_stage, if given. verbose=False turns off
+    the progress messages and bars.
+
+    Dates are kept as datetime64 and normalized dates as int32 day offsets
+    from FIRST_DATE, authors as a categorical and codes as int32.
+    memory_usage() reports the bytes held by each part of the corpus;
+    slim=True (or slim()) releases the notes, edge and team tables once the
+    indexes are built, at the cost of add_notes.
+
+    engine="polars" or engine="duckdb" runs the edge and team joins as a
+    multi-threaded Polars lazy query or DuckDB SQL plan rather than in
+    pandas, with the same results. These need the polars or duckdb package.
     """
-    def __init__(self, notes_df, teamwork_window=90, team_window=2, **columns):
+    def __init__(
+        self,
+        notes_df,
+        teamwork_window=90,
+        team_window=2,
+        first_date=None,
+        cache_size=1024,
+        n_jobs=1,
+        graph_type="networkx",
+        verbose=True,
+        on_stage=None,
+        conditions=None,
+        slim=False,
+        engine="pandas",
+        **columns,
+    ):
+        self.verbose = verbose
+        self.on_stage = on_stage
+        self.stats = dict()
+        start = time.perf_counter()
         self.columns = {**default_columns, **columns}
         self.notes_df = notes_df[self.columns.values()]
-        # self.TEAMWORK_DELTA = np.timedelta64(teamwork_window, "D")
-        self.TEAMWORK_DELTA = timedelta(days=teamwork_window)
+        (self.conditions, self.condition_column) = _get_conditions(notes_df, conditions)
+        if self.conditions:
+            self.notes_df[CONDITION_MASK] = _get_condition_mask(
+                notes_df, self.conditions, self.condition_column
+            )
+        self.TEAMWORK_DELTAS = _get_teamwork_deltas(teamwork_window)
+        self.TEAMWORK_DELTA = self.TEAMWORK_DELTAS[0]
+        self.HISTORY_DELTA = max(self.TEAMWORK_DELTAS)
+        self.weight_names = _get_weight_names(self.TEAMWORK_DELTAS)
         # self.TEAM_DELTA = np.timedelta64(team_window, "D")
         self.TEAM_DELTA = timedelta(days=team_window)
-        print("Preprocessing data...")
-        _prepare_note_data(self.notes_df, self.columns, self.TEAM_DELTA)
-        """TODO: maybe add optional argument for inital date"""
-        self.FIRST_DATE = self.notes_df[self.columns[ADMISSION_DATE]].iloc[0]
-        print("Building experience edge list...")
+        self.cache_size = cache_size
+        self.n_jobs = n_jobs
+        self.graph_type = graph_type
+        self.engine = engine
+        self.__log("Preprocessing data...")
+        if first_date is None:
+            first_date = self.notes_df[self.columns[ADMISSION_DATE]].min()
+        self.FIRST_DATE = pd.Timestamp(first_date)
+        (self.authors, self.visit_ids) = _prepare_note_data(
+            self.notes_df, self.columns, self.TEAM_DELTA, _to_day(self.FIRST_DATE)
+        )
+        start = self.__record_stage("prepare", start, len(self.notes_df))
+        self.__log("Building experience edge list...")
         self.edge_df = _get_edge_data(
-            self.notes_df, self.columns, self.TEAMWORK_DELTA, self.FIRST_DATE
+            self.notes_df, self.columns, self.HISTORY_DELTA, self.FIRST_DATE, engine
         )
-        print("Building team edge list...")
+        start = self.__record_stage("edge join", start, len(self.edge_df))
+        self.__log("Building team edge list...")
         self.team_df = _get_team_data(
-            self.notes_df, self.columns, self.TEAMWORK_DELTA, self.FIRST_DATE
+            self.notes_df, self.columns, self.HISTORY_DELTA, self.FIRST_DATE, engine
         )
+        start = self.__record_stage("team join", start, len(self.team_df))
         self.__build_dicts()
+        self.__record_stage("dict build", start, len(self.edge_to_date_dict))
+        if slim:
+            self.slim()
 
     def __build_dicts(self):
-        self.visit_id_to_edges_dict = dict()
-        self.edge_to_date_dict = dict()
-        self.dx_edge_to_date_dict = dict()
-        self.visit_id_to_team_dict = dict()
-        tqdm.pandas(desc="Building Edge Dictionary")
-        self.edge_df.progress_apply(
-            _add_edge_to_dicts, axis="columns", args=(self.edge_to_date_dict,
-                                                        self.dx_edge_to_date_dict, 
-                                                      self.columns,)
-        )
-        tqdm.pandas(desc="Building Team Dictionary")
-        self.team_df.progress_apply(
-            _add_team_to_dicts,
-            axis="columns",
-            args=(
-                self.visit_id_to_edges_dict,
-                self.visit_id_to_team_dict,
-                self.columns,
+        *_, team_condition = [*self.columns.values()]
+        self.__log("Building edge and team dictionaries...")
+        first_day = _to_day(self.FIRST_DATE)
+        self.edge_to_date_dict = _build_edge_timelines(self.edge_df, first_day)
+        self.dx_edge_to_date_dict = _build_edge_timelines(
+            self.edge_df[self.edge_df[team_condition] == True], first_day
+        )
+        self.condition_edge_to_date_dict = _build_condition_timelines(
+            self.edge_df, len(self.conditions), first_day
+        )
+        (self.visit_id_to_edges_dict, self.visit_id_to_team_dict) = _build_team_dicts(
+            self.team_df, self.authors, self.visit_ids, first_day
+        )
+        self._packed = dict()
+        self._author_lookup = None
+        self._author_dtype = None
+        self.team_experience_dict = _LazyTeamExperienceDict(
+            self._get_visit_team_experience, self.visit_id_to_edges_dict, self.cache_size
+        )
+
+    def materialize_team_experience(self, n_jobs=None):
+        '''
+        Compute the team experience of every visit, for batch jobs.
+        Returns a dict of visit id to team experience.
+        '''
+        items = self.map_visits(lambda visit_id, item: item, n_jobs)
+        return dict(zip(self.visit_id_to_edges_dict, items))
+
+    def map_visits(self, func, n_jobs=None):
+        '''
+        Call func(visit_id, team experience) for every visit, and return the
+        results in visit order.
+
+        With n_jobs other than 1 (default: the corpus n_jobs), the visits are
+        sharded across forked worker processes. The workers share the corpus
+        indexes copy-on-write rather than receiving a pickled copy; only the
+        visit ids and the results are sent between processes. Where fork is
+        not available, the visits are processed serially.
+        '''
+        def process(visit_id):
+            item = self._get_visit_team_experience(
+                visit_id, self.visit_id_to_edges_dict[visit_id]
+            )
+            return func(visit_id, item)
+
+        if n_jobs is None:
+            n_jobs = self.n_jobs
+        start = time.perf_counter()
+        results = _map_in_processes(
+            process, [*self.visit_id_to_edges_dict], n_jobs, self.verbose
+        )
+        self.__record_stage("experience build", start, len(results))
+        return results
+
+    def __log(self, message):
+        if self.verbose:
+            print(message)
+
+    def __record_stage(self, stage, start, rows):
+        '''
+        Record the stats of a stage started at start (a perf_counter time),
+        and return the end time, to start the next stage
+        '''
+        end = time.perf_counter()
+        stage_stats = StageStats(stage, end - start, rows, _get_peak_rss_mb())
+        self.stats[stage] = stage_stats
+        logger.debug("%s", stage_stats)
+        if self.on_stage is not None:
+            self.on_stage(stage_stats)
+        return end
+
+    def add_notes(self, notes_df):
+        '''
+        Add new notes to the corpus without rebuilding it.
+
+        The notes of the visits in notes_df are merged with the notes already
+        in the corpus, and only the edge timelines and team dictionaries of
+        those visits are rebuilt. The team experience is recomputed for the
+        visits with new notes, and for the visits whose teamwork window
+        covers the days of a changed edge. The start of the corpus
+        (FIRST_DATE) is not changed. The corpus loses the fingerprint of
+        ResultCache.get_corpus, as it no longer matches its cache entry.
+
+        Returns the ids of the visits whose team experience was recomputed.
+        '''
+        if self.notes_df is None:
+            raise ValueError(
+                "cannot add notes to a slim corpus or a corpus loaded from an index"
+            )
+        self.fingerprint = None
+        start = time.perf_counter()
+        visit_id, admit_date, *_, team_condition = [*self.columns.values()]
+        new_df = notes_df[self.columns.values()]
+        note_columns = [*self.columns.values()]
+        if self.conditions:
+            new_df[CONDITION_MASK] = _get_condition_mask(
+                notes_df, self.conditions, self.condition_column
+            )
+            note_columns.append(CONDITION_MASK)
+        visits = self.notes_df[VISIT_CODE].isin(
+            pd.Index(self.visit_ids).get_indexer(new_df[visit_id].unique())
+        )
+
+        # re-prepare the new notes together with the old notes of their visits
+        new_df = pd.concat(
+            [self.notes_df.loc[visits, note_columns], new_df],
+            ignore_index=True,
+        )
+        first_day = _to_day(self.FIRST_DATE)
+        (self.authors, _) = _prepare_note_data(
+            new_df, self.columns, self.TEAM_DELTA, first_day, self.authors
+        )
+        new_df[VISIT_CODE], self.visit_ids = _extend_codes(
+            new_df[visit_id], self.visit_ids
+        )
+        new_edge_df = _get_edge_data(
+            new_df, self.columns, self.HISTORY_DELTA, self.FIRST_DATE, self.engine
+        )
+        new_team_df = _get_team_data(
+            new_df, self.columns, self.HISTORY_DELTA, self.FIRST_DATE, self.engine
+        )
+
+        is_old_visit = self.edge_df[VISIT_CODE].isin(new_df[VISIT_CODE].unique())
+        changed_df = pd.concat([self.edge_df[is_old_visit], new_edge_df])
+        self.notes_df = pd.concat([self.notes_df[~visits], new_df]).sort_values(
+            admit_date, kind="stable"
+        )
+        self.edge_df = pd.concat([self.edge_df[~is_old_visit], new_edge_df])
+        is_old_visit = self.team_df[VISIT_CODE].isin(new_df[VISIT_CODE].unique())
+        self.team_df = pd.concat([self.team_df[~is_old_visit], new_team_df])
+
+        # rebuild the timelines of every edge the changed visits touch
+        edges = changed_df[EDGE].unique()
+        edge_df = self.edge_df[self.edge_df[EDGE].isin(edges)]
+        _replace_timelines(
+            self.edge_to_date_dict, edges, _build_edge_timelines(edge_df, first_day)
+        )
+        _replace_timelines(
+            self.dx_edge_to_date_dict,
+            edges,
+            _build_edge_timelines(edge_df[edge_df[team_condition] == True], first_day),
+        )
+        _replace_timelines(
+            self.condition_edge_to_date_dict,
+            edges,
+            _build_condition_timelines(edge_df, len(self.conditions), first_day),
+        )
+
+        for visit in self.visit_ids[new_df[VISIT_CODE].unique()]:
+            self.visit_id_to_edges_dict.pop(visit, None)
+            self.visit_id_to_team_dict.pop(visit, None)
+        (visit_id_to_edges_dict, visit_id_to_team_dict) = _build_team_dicts(
+            new_team_df, self.authors, self.visit_ids, first_day
+        )
+        self.visit_id_to_edges_dict.update(visit_id_to_edges_dict)
+        self.visit_id_to_team_dict.update(visit_id_to_team_dict)
+
+        # visits with a changed edge whose teamwork window covers the changed days
+        changed_visits = [*visit_id_to_edges_dict]
+        if len(changed_df) > 0:
+            days = _from_day_offsets(changed_df[NORM_NOTE_DATE], first_day)
+            admit_days = _from_day_offsets(self.team_df[NORM_ADMISSION_DATE], first_day)
+            is_changed = (
+                self.team_df[EDGE].isin(edges).to_numpy()
+                & (admit_days > days.min())
+                & (admit_days <= days.max() + self.HISTORY_DELTA)
+            )
+            changed_visits += [
+                *self.visit_ids[self.team_df.loc[is_changed, VISIT_CODE].unique()]
+            ]
+        changed_visits = [
+            visit
+            for visit in dict.fromkeys(changed_visits)
+            if visit in self.visit_id_to_edges_dict
+        ]
+        self.team_experience_dict.invalidate(changed_visits)
+        self._packed = dict()
+        self._author_lookup = None
+        self._author_dtype = None
+        self.__record_stage("add notes", start, len(changed_visits))
+        return changed_visits
+
+    def team_edges_df(self):
+        '''
+        Table of the team edges of every visit, with the general and dx
+        experience weight of each edge (0 for pairs with no prior notes).
+        Rows are grouped by visit, in the order of visit_id_to_edges_dict;
+        source and target are categoricals of the author names, and
+        admit_date is the day of admission of the visit. With several
+        teamwork windows, there are also weight_<window> and
+        dx_weight_<window> columns for each window, and with conditions, a
+        <condition>_<weight name> column for each condition and weight.
+
+        The weights are computed in bulk, with one binary search over the
+        timelines of all edges, rather than visit by visit.
+        '''
+        (visits, offsets, edges, admit_days) = self.__get_packed("team")
+        counts = np.diff(offsets)
+        arrive_days = np.repeat(admit_days, counts)
+        start_days = arrive_days - self.TEAMWORK_DELTA
+        (codes_x, codes_y) = _edge_authors(edges)
+        edges_df = pd.DataFrame(
+            {
+                "visit_id": np.repeat(self.visit_ids[visits], counts),
+                "admit_date": arrive_days,
+                "source": pd.Categorical.from_codes(codes_x, dtype=self.__get_author_dtype()),
+                "target": pd.Categorical.from_codes(codes_y, dtype=self.__get_author_dtype()),
+                "weight": _count_in_windows(
+                    self.__get_packed("edge"), edges, start_days, arrive_days
+                ),
+                "dx_weight": _count_in_windows(
+                    self.__get_packed("dx_edge"), edges, start_days, arrive_days
+                ),
+            }
+        )
+        window_names = self.weight_names[1:]
+        for (name, delta) in zip(window_names, self.TEAMWORK_DELTAS):
+            for prefix in ["", "dx_"]:
+                if delta == self.TEAMWORK_DELTA:
+                    edges_df[prefix + name] = edges_df[prefix + "weight"]
+                else:
+                    edges_df[prefix + name] = _count_in_windows(
+                        self.__get_packed(prefix + "edge"),
+                        edges,
+                        arrive_days - delta,
+                        arrive_days,
+                    )
+        if self.conditions:
+            deltas = self.TEAMWORK_DELTAS
+            if len(self.weight_names) > 1:
+                deltas = [self.TEAMWORK_DELTA, *deltas]
+            for (name, delta) in zip(self.weight_names, deltas):
+                counts = _count_in_windows(
+                    self.__get_packed("condition_edge"),
+                    edges,
+                    arrive_days - delta,
+                    arrive_days,
+                )
+                for (i, condition) in enumerate(self.conditions):
+                    edges_df[f"{condition}_{name}"] = counts[:, i]
+        return edges_df
+
+    def network_edges(self, start, end, dx=False):
+        '''
+        Edgelist of the hospital-wide collaboration network in the window
+        [start, end): every pair of authors who wrote notes for the same
+        visit on the same day in the window, weighted by the number of such
+        visit days (with dx, only visits with the team condition).
+        Returns a DataFrame of source, target (categoricals of the author
+        names) and weight, computed with one binary search per edge over
+        the edge timelines.
+        '''
+        packed = self.__get_packed("dx_edge" if dx else "edge")
+        keys = packed[0]
+        weights = _count_in_windows(
+            packed,
+            keys,
+            np.full(len(keys), _to_day(start)),
+            np.full(len(keys), _to_day(end)),
+        )
+        return self.__network_edges_df(keys, weights)
+
+    def network(self, start, end, dx=False):
+        '''
+        Collaboration network in the window [start, end) (see network_edges),
+        as a networkx Graph, or a TeamGraph with graph_type="adjacency"
+        '''
+        edges_df = self.network_edges(start, end, dx)
+        edge_list = list(
+            zip(
+                edges_df["source"].astype(object),
+                edges_df["target"].astype(object),
+                edges_df["weight"].tolist(),
+            )
+        )
+        return _get_team_graph(edge_list, ["weight"], self.graph_type)[0]
+
+    def iter_network_edges(self, start, end, freq="MS", window=None, dx=False):
+        '''
+        Sliding-window series of collaboration networks: for each date of
+        pd.date_range(start, end, freq=freq), yields the date and the
+        network_edges of the window [date - window, date). window is a
+        number of days, by default the teamwork window.
+
+        The note days of all edges are sorted once, and each window is
+        updated from the previous one by adding and removing only the days
+        that enter and leave it.
+        '''
+        (keys, offsets, days, cumcounts, _) = self.__get_packed("dx_edge" if dx else "edge")
+        window = self.TEAMWORK_DELTA if window is None else np.timedelta64(window, "D")
+        order = np.argsort(days, kind="stable")
+        days = np.asarray(days)[order]
+        day_edges = np.repeat(np.arange(len(keys)), np.diff(offsets))[order]
+        day_counts = np.diff(cumcounts)[order]
+
+        weights = np.zeros(len(keys), dtype=np.int64)
+        (lo, hi) = (0, 0)  # the window holds the sorted days [lo, hi)
+        for date in pd.date_range(start, end, freq=freq):
+            day = _to_day(date)
+            (new_lo, new_hi) = days.searchsorted([day - window, day])
+            # add the days that enter the window, remove those that leave it
+            for (a, b, sign) in [(hi, new_hi, 1), (lo, new_lo, -1)]:
+                if a > b:
+                    (a, b, sign) = (b, a, -sign)
+                np.add.at(weights, day_edges[a:b], sign * day_counts[a:b])
+            (lo, hi) = (new_lo, new_hi)
+            yield date, self.__network_edges_df(keys, weights)
+
+    def __network_edges_df(self, edges, weights):
+        has_weight = weights > 0
+        (codes_x, codes_y) = _edge_authors(np.asarray(edges)[has_weight])
+        return pd.DataFrame(
+            {
+                "source": pd.Categorical.from_codes(codes_x, dtype=self.__get_author_dtype()),
+                "target": pd.Categorical.from_codes(codes_y, dtype=self.__get_author_dtype()),
+                "weight": weights[has_weight],
+            }
+        )
+
+    def partners(self, author, date, window=None, dx=False):
+        '''
+        Prior shared experience of author with each of their partners as of
+        date: the number of visit days they wrote notes on together in the
+        window [date - window, date) (window in days, by default the
+        teamwork window; with dx, only visits with the team condition).
+        Returns a DataFrame of partner (a categorical of the author names)
+        and weight, for the partners with a positive weight.
+
+        The author's edges are read from the per-author index, so a lookup
+        costs a binary search per partner of the author.
+        '''
+        code = self.__author_codes([author])[0]
+        (offsets, partners, edge_index) = self.__get_packed("author")
+        (start, end) = (offsets[code], offsets[code + 1])
+        day = _to_day(date)
+        window = self.TEAMWORK_DELTA if window is None else np.timedelta64(window, "D")
+        weights = _count_in_windows(
+            self.__get_packed("dx_edge" if dx else "edge"),
+            self.__get_packed("edge")[0][edge_index[start:end]],
+            np.full(end - start, day - window),
+            np.full(end - start, day),
+        )
+        has_weight = weights > 0
+        return pd.DataFrame(
+            {
+                "partner": pd.Categorical.from_codes(
+                    partners[start:end][has_weight], dtype=self.__get_author_dtype()
+                ),
+                "weight": weights[has_weight],
+            }
+        )
+
+    def author_experience(self, authors, dates, window=None, dx=False):
+        '''
+        Batch version of partners: the total prior shared experience (sum of
+        the partner weights) and the number of partners of each of authors
+        as of the matching one of dates (or of a single date).
+
+        All the (author, date) pairs are answered with one vectorized
+        binary search over the edges of their authors.
+        '''
+        codes = self.__author_codes(authors)
+        days = np.broadcast_to(
+            np.asarray(pd.to_datetime(np.atleast_1d(dates))).astype("datetime64[D]"),
+            codes.shape,
+        )
+        window = self.TEAMWORK_DELTA if window is None else np.timedelta64(window, "D")
+        (offsets, partners, edge_index) = self.__get_packed("author")
+
+        # expand every query into the index positions of its author's edges
+        starts = offsets[codes]
+        degrees = offsets[codes + 1] - starts
+        query = np.repeat(np.arange(len(codes)), degrees)
+        first = np.cumsum(degrees) - degrees
+        positions = np.repeat(starts - first, degrees) + np.arange(len(query))
+        weights = _count_in_windows(
+            self.__get_packed("dx_edge" if dx else "edge"),
+            self.__get_packed("edge")[0][edge_index[positions]],
+            days[query] - window,
+            days[query],
+        )
+        return pd.DataFrame(
+            {
+                "author": self.authors[codes],
+                "date": days,
+                "experience": np.bincount(query, weights=weights, minlength=len(codes)).astype(np.int64),
+                "partners": np.bincount(query, weights=weights > 0, minlength=len(codes)).astype(np.int64),
+            }
+        )
+
+    def score_team(self, authors, date, window=None):
+        '''
+        Prior shared experience of a hypothetical team of authors admitted
+        on date, weighted as the team experience of a visit: the edgelist
+        and dx_edgelist of (source, target, weight) tuples of the pairs with
+        a positive weight in the window [date - window, date) (window in
+        days, by default the teamwork window), and the summary metrics of
+        score_teams. Authors with no notes in the corpus have no experience.
+        '''
+        (team_size, pair_teams, codes_x, codes_y, weights, dx_weights) = self.__score(
+            [authors], date, window
+        )
+        (sources, targets) = (self.authors[codes_x], self.authors[codes_y])
+        experience = int(weights.sum())
+        team_edge_size = int(np.count_nonzero(weights))
+        potential_edges = int(team_size[0] * (team_size[0] - 1) // 2)
+        return {
+            "team": set(authors),
+            "edgelist": [
+                (source, target, weight)
+                for (source, target, weight) in zip(sources, targets, weights.tolist())
+                if weight > 0
+            ],
+            "dx_edgelist": [
+                (source, target, weight)
+                for (source, target, weight) in zip(sources, targets, dx_weights.tolist())
+                if weight > 0
+            ],
+            "team_size": int(team_size[0]),
+            "potential_edges": potential_edges,
+            "team_edge_size": team_edge_size,
+            "experience": experience,
+            "dx_experience": int(dx_weights.sum()),
+            "cumulative_experience": experience - team_edge_size,
+            "avg_cumulative_experience": (
+                (experience - team_edge_size) / potential_edges if potential_edges > 0 else 0
             ),
+        }
+
+    def score_teams(self, teams, dates, window=None):
+        '''
+        Batch version of score_team: score each of teams (collections of
+        authors) as of the matching one of dates (or of a single date), with
+        one vectorized lookup over the edge timelines for all their pairs.
+
+        Returns a DataFrame of the summary metrics of each team, by position
+        in teams, and a DataFrame of the team (position), source, target,
+        weight and dx_weight of every pair with a positive weight.
+        '''
+        (team_size, pair_teams, codes_x, codes_y, weights, dx_weights) = self.__score(
+            teams, dates, window
+        )
+        n_teams = len(team_size)
+        potential_edges = team_size * (team_size - 1) // 2
+        team_edge_size = np.bincount(
+            pair_teams, weights=weights > 0, minlength=n_teams
+        ).astype(np.int64)
+        experience = np.bincount(pair_teams, weights=weights, minlength=n_teams).astype(np.int64)
+        cumulative_experience = experience - team_edge_size
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg_cumulative_experience = np.where(
+                potential_edges > 0, cumulative_experience / potential_edges, 0
+            )
+        scores_df = pd.DataFrame(
+            {
+                "team_size": team_size,
+                "potential_edges": potential_edges,
+                "team_edge_size": team_edge_size,
+                "experience": experience,
+                "dx_experience": np.bincount(
+                    pair_teams, weights=dx_weights, minlength=n_teams
+                ).astype(np.int64),
+                "cumulative_experience": cumulative_experience,
+                "avg_cumulative_experience": avg_cumulative_experience,
+            }
+        )
+        has_weight = (weights > 0) | (dx_weights > 0)
+        edges_df = pd.DataFrame(
+            {
+                "team": pair_teams[has_weight],
+                "source": pd.Categorical.from_codes(
+                    codes_x[has_weight], dtype=self.__get_author_dtype()
+                ),
+                "target": pd.Categorical.from_codes(
+                    codes_y[has_weight], dtype=self.__get_author_dtype()
+                ),
+                "weight": weights[has_weight],
+                "dx_weight": dx_weights[has_weight],
+            }
+        )
+        return scores_df, edges_df
+
+    def __score(self, teams, dates, window):
+        '''
+        Team sizes, and the team, author codes and weights of every pair of
+        authors of teams who have notes in the corpus
+        '''
+        sizes = np.array([len(team) for team in teams], dtype=np.int64)
+        team_of = np.repeat(np.arange(len(teams), dtype=np.int64), sizes)
+        lookup = self.__get_author_lookup()
+        n_authors = len(self.authors)
+        unknown = dict()  # authors not in the corpus get codes from n_authors
+
+        def get_code(author):
+            code = lookup.get(author)
+            if code is None:
+                code = unknown.setdefault(author, n_authors + len(unknown))
+            return code
+
+        codes = np.fromiter(
+            (get_code(author) for team in teams for author in team),
+            dtype=np.int64,
+            count=len(team_of),
+        )
+        # unique members of each team, sorted by team and code
+        members = np.unique((team_of << 32) | codes)
+        member_teams = members >> 32
+        team_size = np.bincount(member_teams, minlength=len(teams))
+
+        # pair the members of each team with notes, lower code first
+        codes = members & 0xFFFFFFFF
+        is_known = codes < n_authors
+        (member_teams, codes) = (member_teams[is_known], codes[is_known])
+        (i, j) = _pair_indices(member_teams)
+        (pair_teams, codes_x, codes_y) = (member_teams[i], codes[i], codes[j])
+
+        if np.ndim(dates) == 0:
+            days = _to_day(dates)
+        else:
+            days = np.asarray(pd.to_datetime(dates)).astype("datetime64[D]")[pair_teams]
+        window = self.TEAMWORK_DELTA if window is None else np.timedelta64(window, "D")
+        edges = _edge_key(codes_x, codes_y)
+        (weights, dx_weights) = [
+            _count_in_windows(self.__get_packed(name), edges, days - window, days)
+            for name in ["edge", "dx_edge"]
+        ]
+        return team_size, pair_teams, codes_x, codes_y, weights, dx_weights
+
+    def __get_author_lookup(self):
+        '''
+        Dict of author name to code, built on first use
+        '''
+        if self._author_lookup is None:
+            self._author_lookup = dict(zip(self.authors, range(len(self.authors))))
+        return self._author_lookup
+
+    def __get_author_dtype(self):
+        '''
+        Categorical dtype of the author names, built on first use
+        '''
+        if self._author_dtype is None:
+            self._author_dtype = pd.CategoricalDtype(self.authors)
+        return self._author_dtype
+
+    def __author_codes(self, authors):
+        lookup = self.__get_author_lookup()
+        codes = np.array([lookup.get(author, -1) for author in authors], dtype=np.int64)
+        if (codes == -1).any():
+            unknown = np.asarray(authors, dtype=object)[codes == -1]
+            raise KeyError(f"unknown authors: {[*unknown[:5]]}")
+        return codes
+
+    def admission_dates(self):
+        '''
+        Day of admission of every visit, as a Series indexed by visit id
+        in the order of visit_id_to_edges_dict
+        '''
+        (visits, _, _, admit_days) = self.__get_packed("team")
+        return pd.Series(
+            np.asarray(admit_days), index=pd.Index(self.visit_ids[visits], name="visit_id")
+        )
+
+    def team_edges_to_parquet(self, path, partition_cols=("admit_month",)):
+        '''
+        Write team_edges_df to a Parquet dataset in the directory path,
+        partitioned by partition_cols (by default by month of admission,
+        as admit_month=YYYY-MM directories), for Spark or DuckDB jobs.
+        Requires pyarrow.
+        '''
+        edges_df = self.team_edges_df()
+        edges_df[ADMIT_MONTH] = _month_labels(edges_df["admit_date"])
+        _write_parquet(edges_df, path, partition_cols)
+
+    def memory_usage(self):
+        '''
+        Bytes held by each part of the corpus, as a Series: the notes, edge
+        and team tables, the timeline and team dictionaries, and the packed
+        indexes. Timelines that are views into shared arrays count the shared
+        arrays once.
+        '''
+        usage = dict()
+        for name in ["notes_df", "edge_df", "team_df"]:
+            df = getattr(self, name)
+            usage[name] = 0 if df is None else int(df.memory_usage(deep=True).sum())
+        for name in ["edge", "dx_edge", "condition_edge"]:
+            usage[f"{name}_to_date_dict"] = _timelines_nbytes(
+                getattr(self, f"{name}_to_date_dict")
+            )
+        usage["team_dicts"] = _team_dicts_nbytes(
+            self.visit_id_to_edges_dict, self.visit_id_to_team_dict
+        )
+        usage["packed"] = sum(
+            np.asarray(array).nbytes
+            for packed in self._packed.values()
+            for array in packed
         )
-        self.team_experience_dict = {
-            k: self.__get_team_experience(k, v)
-            for (k, v) in tqdm(self.visit_id_to_edges_dict.items())
+        return pd.Series(usage, name="bytes")
+
+    def slim(self):
+        '''
+        Release the notes, edge and team tables, which are only needed to
+        build the indexes and to add notes. A slim corpus computes the same
+        team experience, but notes can no longer be added to it.
+        '''
+        if self.verbose or logger.isEnabledFor(logging.DEBUG):
+            usage = self.memory_usage()
+            before = usage.sum()
+            after = before - usage[["notes_df", "edge_df", "team_df"]].sum()
+            logger.debug("slim: %d bytes before, %d bytes after", before, after)
+            self.__log(
+                f"Memory: {before / 2**20:.1f} MB before slim, {after / 2**20:.1f} MB after"
+            )
+        self.notes_df = self.edge_df = self.team_df = None
+        return self
+
+    def __get_packed(self, name):
+        '''
+        CSR layout of the "edge", "dx_edge" or "condition_edge" timelines
+        (with their day keys, see _count_in_windows), of the "team" edges,
+        or of the edges of each "author", built on first use
+        '''
+        if name not in self._packed:
+            if name == "team":
+                packed = _pack_team_edges(self.visit_id_to_edges_dict, self.visit_ids)
+            elif name == "author":
+                packed = _build_author_index(self.__get_packed("edge")[0], len(self.authors))
+            elif name == "condition_edge":
+                packed = _pack_timelines(
+                    self.condition_edge_to_date_dict, (len(self.conditions),)
+                )
+                packed = (*packed, _day_keys(packed[1], packed[2]))
+            else:
+                packed = _pack_timelines(getattr(self, f"{name}_to_date_dict"))
+                packed = (*packed, _day_keys(packed[1], packed[2]))
+            self._packed[name] = packed
+        return self._packed[name]
+
+    def save(self, path):
+        '''
+        Save the corpus indexes to the directory path, as NumPy arrays that
+        TeamworkCorpus.load memory-maps. The notes, edge and team tables and
+        the team graphs are not saved; graphs are rebuilt on access.
+        '''
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            "version": INDEX_VERSION,
+            "columns": self.columns,
+            "teamwork_window": _get_teamwork_window(self.TEAMWORK_DELTAS),
+            "team_window": self.TEAM_DELTA.days,
+            "first_date": self.FIRST_DATE.isoformat(),
+            "conditions": self.conditions,
+            "condition_column": self.condition_column,
         }
+        arrays = {}
+        prefixes = ["edge", "dx_edge"] + (["condition_edge"] if self.conditions else [])
+        for prefix in prefixes:
+            (edges, offsets, days, cumcounts, _) = self.__get_packed(prefix)
+            arrays[f"{prefix}_keys"] = edges
+            arrays[f"{prefix}_offsets"] = offsets
+            arrays[f"{prefix}_days"] = days
+            arrays[f"{prefix}_cumcounts"] = cumcounts
+        (visits, offsets, edges, admit_days) = self.__get_packed("team")
+        arrays["team_visits"] = visits
+        arrays["team_offsets"] = offsets
+        arrays["team_edges"] = edges
+        arrays["team_admit_days"] = admit_days
+        for (name, table) in [("authors", self.authors), ("visit_ids", self.visit_ids)]:
+            if table.dtype == object:
+                meta[name] = table.tolist()
+            else:
+                arrays[name] = table
+        for (name, array) in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, INDEX_META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(
+        cls,
+        path,
+        cache_size=1024,
+        n_jobs=1,
+        graph_type="networkx",
+        verbose=True,
+        on_stage=None,
+    ):
+        '''
+        Load a corpus saved with save. The arrays are memory-mapped read-only,
+        so several processes loading the same index share its pages.
+        The timeline and team dictionaries are read-only mappings over the
+        arrays, whose entries are built on first access, so loading does
+        not depend on the number of edges or visits.
+        The loaded corpus has no notes, edge or team tables.
+        '''
+        start = time.perf_counter()
+        with open(os.path.join(path, INDEX_META_FILE)) as f:
+            meta = json.load(f)
+        if meta["version"] != INDEX_VERSION:
+            raise ValueError(
+                f"unsupported index version {meta['version']}, expected {INDEX_VERSION}"
+            )
 
-    def __get_edge_list_item(self, edge_item):
-        edge = edge_item[0]
-        if edge not in self.edge_to_date_dict:
-            return None
-        (dr_x, dr_y) = edge_item[1]
-        arrive_date = edge_item[2]
-
-        weight = len(
-            [
-                note_day
-                for note_day in self.edge_to_date_dict[edge]
-                if (note_day < arrive_date)
-                and (note_day >= (arrive_date - self.TEAMWORK_DELTA))
+        def load_array(name):
+            # a plain ndarray view of the memory map: slicing a np.memmap is slow
+            return np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+        self = cls.__new__(cls)
+        self.verbose = verbose
+        self.on_stage = on_stage
+        self.stats = dict()
+        self.columns = meta["columns"]
+        self.TEAMWORK_DELTAS = _get_teamwork_deltas(meta["teamwork_window"])
+        self.TEAMWORK_DELTA = self.TEAMWORK_DELTAS[0]
+        self.HISTORY_DELTA = max(self.TEAMWORK_DELTAS)
+        self.weight_names = _get_weight_names(self.TEAMWORK_DELTAS)
+        self.TEAM_DELTA = timedelta(days=meta["team_window"])
+        self.FIRST_DATE = pd.Timestamp(meta["first_date"])
+        self.conditions = meta.get("conditions", [])
+        self.condition_column = meta.get("condition_column")
+        self.cache_size = cache_size
+        self.n_jobs = n_jobs
+        self.graph_type = graph_type
+        self.engine = "pandas"
+        self.notes_df = self.edge_df = self.team_df = None
+        for name in ["authors", "visit_ids"]:
+            if name in meta:
+                table = np.array(meta[name], dtype=object)
+            else:
+                table = load_array(name)
+            setattr(self, name, table)
+        self._packed = dict()
+        self._author_lookup = None
+        self._author_dtype = None
+        self.condition_edge_to_date_dict = dict()
+        prefixes = ["edge", "dx_edge"] + (["condition_edge"] if self.conditions else [])
+        for prefix in prefixes:
+            packed = [
+                load_array(f"{prefix}_{name}")
+                for name in ["keys", "offsets", "days", "cumcounts"]
             ]
+            setattr(self, f"{prefix}_to_date_dict", _PackedTimelines(*packed))
+            self._packed[prefix] = (*packed, _day_keys(packed[1], packed[2]))
+        self._packed["team"] = [
+            load_array(f"team_{name}")
+            for name in ["visits", "offsets", "edges", "admit_days"]
+        ]
+        self.visit_id_to_edges_dict = _PackedTeamEdges(
+            *self._packed["team"], self.visit_ids
         )
-        if weight < 1:
-            return None
-        return {"source": dr_x, "target": dr_y, "weight": weight}
- 
-    def __get_dx_edge_list_item(self, edge_item):
-        edge = edge_item[0]
-        if edge not in self.dx_edge_to_date_dict:
-            return None
-        (dr_x, dr_y) = edge_item[1]
-        arrive_date = edge_item[2]
-
-        weight = len(
-            [
-                note_day
-                for note_day in self.dx_edge_to_date_dict[edge]
-                if (note_day < arrive_date)
-                and (note_day >= (arrive_date - self.TEAMWORK_DELTA))
-            ]
+        self.visit_id_to_team_dict = _PackedTeams(self.visit_id_to_edges_dict, self.authors)
+        self.team_experience_dict = _LazyTeamExperienceDict(
+            self._get_visit_team_experience, self.visit_id_to_edges_dict, self.cache_size
         )
-        if weight < 1:
-            return None
-        return {"source": dr_x, "target": dr_y, "weight": weight}
+        self.__record_stage("load", start, len(self.visit_id_to_edges_dict))
+        return self
 
-    def __get_team_experience(self, visit_id, edge_items):
-        edge_list = [self.__get_edge_list_item(edge_item) for edge_item in edge_items]
-        edge_list = [e for e in edge_list if e is not None]
-        edge_list_df = pd.DataFrame(edge_list, columns=["source", "target", "weight"])
-        g = nx.from_pandas_edgelist(
-            edge_list_df, source="source", target="target", edge_attr="weight"
+    def _get_visit_team_experience(self, visit_id, edge_items):
+        # not name-mangled: the lazy team experience dict holds this bound
+        # method, and pickle looks bound methods up by name
+        return _get_team_experience(
+            edge_items,
+            self.visit_id_to_team_dict[visit_id],
+            self.authors,
+            self.edge_to_date_dict,
+            self.dx_edge_to_date_dict,
+            self.TEAMWORK_DELTAS,
+            self.graph_type,
+            self.conditions,
+            self.condition_edge_to_date_dict,
         )
-        
-        dx_edge_list = [self.__get_dx_edge_list_item(edge_item) for edge_item in edge_items]
-        dx_edge_list = [e for e in dx_edge_list if e is not None]
-        dx_edge_list_df = pd.DataFrame(dx_edge_list, columns=["source", "target", "weight"])
-        dx_g = nx.from_pandas_edgelist(
-            dx_edge_list_df, source="source", target="target", edge_attr="weight"
+
+
+class _LazyTeamExperienceDict(Mapping):
+    '''
+    Read-only mapping of visit id to team experience. The team experience of
+    a visit is computed on first access, and the most recently read visits
+    are cached, up to cache_size (None for no limit).
+    '''
+    def __init__(self, get_team_experience, visit_id_to_edges_dict, cache_size):
+        self.get_team_experience = get_team_experience
+        self.visit_id_to_edges_dict = visit_id_to_edges_dict
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __getitem__(self, visit_id):
+        if visit_id in self.cache:
+            self.cache.move_to_end(visit_id)
+            return self.cache[visit_id]
+        item = self.get_team_experience(visit_id, self.visit_id_to_edges_dict[visit_id])
+        self.cache[visit_id] = item
+        if self.cache_size is not None and len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return item
+
+    def __iter__(self):
+        return iter(self.visit_id_to_edges_dict)
+
+    def __len__(self):
+        return len(self.visit_id_to_edges_dict)
+
+    def __contains__(self, visit_id):
+        return visit_id in self.visit_id_to_edges_dict
+
+    def invalidate(self, visit_ids=None):
+        '''
+        Drop the cached team experience of visit_ids (of every visit if None)
+        '''
+        if visit_ids is None:
+            self.cache.clear()
+        for visit_id in visit_ids or []:
+            self.cache.pop(visit_id, None)
+
+
+class _PackedTimelines(Mapping):
+    '''
+    Read-only mapping of edge key to EdgeTimeline over timelines in the CSR
+    layout of _pack_timelines. A timeline is found by a binary search of the
+    sorted edge keys on first access, and kept for later accesses.
+    '''
+    def __init__(self, edges, offsets, days, cumcounts):
+        self.edges = edges
+        self.offsets = offsets
+        self.days = days
+        self.cumcounts = cumcounts
+        self.cache = dict()
+
+    def __getitem__(self, edge):
+        timeline = self.cache.get(edge)
+        if timeline is None:
+            i = self.edges.searchsorted(edge)
+            if i == len(self.edges) or self.edges[i] != edge:
+                raise KeyError(edge)
+            (start, end) = self.offsets[i : i + 2]
+            timeline = EdgeTimeline(self.days[start:end], self.cumcounts[start : end + 1])
+            self.cache[edge] = timeline
+        return timeline
+
+    def __iter__(self):
+        return iter(self.edges.tolist())
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __contains__(self, edge):
+        i = self.edges.searchsorted(edge)
+        return i < len(self.edges) and self.edges[i] == edge
+
+
+class _PackedTeamEdges(Mapping):
+    '''
+    Read-only mapping of visit id to team edges, (edge, author codes,
+    admission day) items, over the CSR layout of _pack_team_edges. The
+    items of a visit are built on access.
+    '''
+    def __init__(self, visits, offsets, edges, admit_days, visit_ids):
+        self.index = pd.Index(visit_ids[visits])
+        self.offsets = offsets
+        self.edges = edges
+        self.admit_days = admit_days
+
+    def __getitem__(self, visit_id):
+        i = self.index.get_loc(visit_id)
+        edges = self.edges[self.offsets[i] : self.offsets[i + 1]]
+        (codes_x, codes_y) = _edge_authors(edges)
+        admit_day = self.admit_days[i]
+        return [
+            (edge, codes, admit_day)
+            for (edge, codes) in zip(edges.tolist(), zip(codes_x.tolist(), codes_y.tolist()))
+        ]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, visit_id):
+        return visit_id in self.index
+
+    def get_team_codes(self, visit_id):
+        '''
+        Author codes of the team of a visit
+        '''
+        i = self.index.get_loc(visit_id)
+        (codes_x, codes_y) = _edge_authors(self.edges[self.offsets[i] : self.offsets[i + 1]])
+        return np.union1d(codes_x, codes_y)
+
+
+class _PackedTeams(Mapping):
+    '''
+    Read-only mapping of visit id to the set of team authors, built on
+    access from a _PackedTeamEdges
+    '''
+    def __init__(self, team_edges, authors):
+        self.team_edges = team_edges
+        self.authors = authors
+
+    def __getitem__(self, visit_id):
+        return set(self.authors[self.team_edges.get_team_codes(visit_id)])
+
+    def __iter__(self):
+        return iter(self.team_edges)
+
+    def __len__(self):
+        return len(self.team_edges)
+
+    def __contains__(self, visit_id):
+        return visit_id in self.team_edges
+
+
+def _map_in_processes(func, items, n_jobs, progress=True):
+    '''
+    Map func over items, in order, using n_jobs forked worker processes.
+    func is inherited by the workers at fork, so it is never pickled.
+    '''
+    global _worker_func
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [func(item) for item in tqdm(items, disable=not progress)]
+
+    n_shards = min(len(items), n_jobs * 4) or 1
+    bounds = np.linspace(0, len(items), n_shards + 1).astype(int)
+    shards = [items[start:end] for (start, end) in zip(bounds[:-1], bounds[1:])]
+    _worker_func = func
+    try:
+        with multiprocessing.get_context("fork").Pool(n_jobs) as pool:
+            results = pool.map(_map_shard, shards)
+    finally:
+        _worker_func = None
+    return [result for shard in results for result in shard]
+
+
+def _map_shard(items):
+    return [_worker_func(item) for item in items]
+
+
+# function mapped by the worker processes of _map_in_processes
+_worker_func = None
+
+
+def _get_peak_rss_mb():
+    '''
+    Peak resident set size of this process in MB, or None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if os.uname().sysname == "Darwin" else peak / 2**10
+
+
+def _get_teamwork_deltas(teamwork_window):
+    '''
+    The teamwork windows (a number of days, or a list of them) as a list
+    of timedelta64s
+    '''
+    windows = np.atleast_1d(teamwork_window)
+    if len(windows) == 0:
+        raise ValueError("teamwork_window must have at least one window")
+    if len(np.unique(windows)) < len(windows):
+        raise ValueError(f"teamwork_window has duplicate windows: {windows.tolist()}")
+    return [np.timedelta64(int(window), "D") for window in windows]
+
+
+def _get_teamwork_window(teamwork_deltas):
+    '''
+    Inverse of _get_teamwork_deltas, as a number of days or a list of them
+    '''
+    windows = [int(delta / np.timedelta64(1, "D")) for delta in teamwork_deltas]
+    return windows[0] if len(windows) == 1 else windows
+
+
+def _get_weight_names(teamwork_deltas):
+    '''
+    Names of the weights of a team edge: weight, then weight_<window> for
+    each window if there are several
+    '''
+    if len(teamwork_deltas) == 1:
+        return ["weight"]
+    return ["weight"] + [
+        f"weight_{window}" for window in _get_teamwork_window(teamwork_deltas)
+    ]
+
+
+def _get_weighted_edges(edge_items, edge_to_date_dict, authors, teamwork_deltas):
+    '''
+    (source, target, *weights) tuples of the team edges of a visit with a
+    positive experience weight in a teamwork window before admission, with
+    the weights named by _get_weight_names
+    '''
+    if len(edge_items) == 0:
+        return []
+    # every team edge of a visit has the same admission date
+    arrive_date = np.datetime64(edge_items[0][2], "D")
+    if len(teamwork_deltas) == 1:
+        start_date = arrive_date - teamwork_deltas[0]
+        weighted_edges = []
+        for (edge, (code_x, code_y), _) in edge_items:
+            timeline = edge_to_date_dict.get(edge)
+            if timeline is None:
+                continue
+            weight = _count_in_window(timeline, start_date, arrive_date)
+            if weight > 0:
+                weighted_edges.append((authors[code_x], authors[code_y], weight))
+        return weighted_edges
+
+    # one binary search per edge for the starts of every window
+    bounds = [arrive_date - delta for delta in teamwork_deltas] + [arrive_date]
+    weighted_edges = []
+    for (edge, (code_x, code_y), _) in edge_items:
+        timeline = edge_to_date_dict.get(edge)
+        if timeline is None:
+            continue
+        ends = timeline.cumcounts[timeline.days.searchsorted(bounds)]
+        weights = (ends[-1] - ends[:-1]).tolist()
+        if any(weights):
+            weighted_edges.append(
+                (authors[code_x], authors[code_y], weights[0], *weights)
+            )
+    return weighted_edges
+
+
+def _get_condition_weighted_edges(
+    edge_items, condition_edge_to_date_dict, authors, teamwork_deltas, n_conditions
+):
+    '''
+    _get_weighted_edges for every condition at once, from timelines with a
+    column of counts per condition. Returns a list of edge tuples per
+    condition.
+    '''
+    edge_lists = [[] for _ in range(n_conditions)]
+    if len(edge_items) == 0:
+        return edge_lists
+    arrive_date = np.datetime64(edge_items[0][2], "D")
+    bounds = [arrive_date - delta for delta in teamwork_deltas] + [arrive_date]
+    for (edge, (code_x, code_y), _) in edge_items:
+        timeline = condition_edge_to_date_dict.get(edge)
+        if timeline is None:
+            continue
+        ends = timeline.cumcounts[timeline.days.searchsorted(bounds)]
+        # weights of the edge, by window and condition
+        weights = ends[-1] - ends[:-1]
+        for i in np.flatnonzero(weights.any(axis=0)):
+            window_weights = weights[:, i].tolist()
+            if len(window_weights) > 1:
+                window_weights.insert(0, window_weights[0])
+            edge_lists[i].append((authors[code_x], authors[code_y], *window_weights))
+    return edge_lists
+
+
+def _get_team_experience(
+    edge_items,
+    team,
+    authors,
+    edge_to_date_dict,
+    dx_edge_to_date_dict,
+    teamwork_deltas,
+    graph_type="networkx",
+    conditions=(),
+    condition_edge_to_date_dict=None,
+):
+    '''
+    Weight the team edges of a visit by the experience of each pair in the
+    teamwork window before admission, and build the team graphs.
+
+    With graph_type "networkx", the graphs are networkx Graphs and the
+    edgelists DataFrames. With "adjacency", the graphs are TeamGraphs and
+    the edgelists lists of (source, target, weight) tuples, which skips the
+    cost of building DataFrames and networkx objects for every visit.
+
+    teamwork_deltas is the list of teamwork windows; the edges carry a
+    weight per name of _get_weight_names. With conditions, the graphs and
+    edgelists of each condition are added as condition_graphs and
+    condition_edgelists.
+    '''
+    weight_names = _get_weight_names(teamwork_deltas)
+    edge_list = _get_weighted_edges(
+        edge_items, edge_to_date_dict, authors, teamwork_deltas
+    )
+    dx_edge_list = _get_weighted_edges(
+        edge_items, dx_edge_to_date_dict, authors, teamwork_deltas
+    )
+    (g, edge_list) = _get_team_graph(edge_list, weight_names, graph_type)
+    (dx_g, dx_edge_list) = _get_team_graph(dx_edge_list, weight_names, graph_type)
+    item = {"team": team, "graph": g, "dx_graph": dx_g, "edgelist": edge_list, "dx_edgelist": dx_edge_list}
+
+    if len(conditions) > 0:
+        condition_edge_lists = _get_condition_weighted_edges(
+            edge_items,
+            condition_edge_to_date_dict,
+            authors,
+            teamwork_deltas,
+            len(conditions),
         )
-        
-        team = self.visit_id_to_team_dict[visit_id]
-        return {"team": team, "graph": g, "dx_graph": dx_g, "edgelist": edge_list_df, "dx_edgelist": dx_edge_list_df}
+        item["condition_graphs"] = dict()
+        item["condition_edgelists"] = dict()
+        for (condition, condition_edge_list) in zip(conditions, condition_edge_lists):
+            (item["condition_graphs"][condition], item["condition_edgelists"][condition]) = (
+                _get_team_graph(condition_edge_list, weight_names, graph_type)
+            )
+    return item
 
 
-def _prepare_note_data(notes_df, columns, team_delta):
+def _get_team_graph(edge_list, weight_names, graph_type):
+    '''
+    Team graph and edgelist of the graph_type (see _get_team_experience)
+    from (source, target, *weights) tuples
+    '''
+    if graph_type == "adjacency":
+        return TeamGraph(edge_list, weight_names), edge_list
+    elif graph_type == "networkx":
+        return (
+            _to_networkx(edge_list, weight_names),
+            pd.DataFrame(edge_list, columns=["source", "target", *weight_names]),
+        )
+    raise ValueError(f"unknown graph_type: {graph_type}")
+
+
+class TeamGraph:
+    """
+    Lightweight weighted graph of a care team, returned instead of a networkx
+    Graph when a TeamworkCorpus is built with graph_type="adjacency".
+
+    Holds the edges with a positive weight as (source, target, *weights)
+    tuples, with the weights named by weight_names. Nodes are listed in
+    order of first appearance in the edges, as in the equivalent networkx
+    Graph.
+    """
+    def __init__(self, edges, weight_names=("weight",)):
+        self.edges = edges
+        self.weight_names = [*weight_names]
+
+    @property
+    def nodes(self):
+        return [*dict.fromkeys(node for edge in self.edges for node in edge[:2])]
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def size(self, weight=None):
+        if weight is None:
+            return len(self.edges)
+        i = 2 + self.weight_names.index(weight)
+        return sum(edge[i] for edge in self.edges)
+
+    def to_networkx(self):
+        return _to_networkx(self.edges, self.weight_names)
+
+    def to_scipy(self):
+        '''
+        Symmetric scipy sparse adjacency matrix, indexed like nodes.
+        Requires scipy.
+        '''
+        from scipy import sparse
+
+        nodes = self.nodes
+        index = {node: i for (i, node) in enumerate(nodes)}
+        rows = [index[edge[0]] for edge in self.edges]
+        cols = [index[edge[1]] for edge in self.edges]
+        weights = [edge[2] for edge in self.edges]
+        return sparse.csr_matrix(
+            (weights + weights, (rows + cols, cols + rows)), shape=(len(nodes), len(nodes))
+        )
+
+
+def _to_networkx(edge_list, weight_names):
+    '''
+    networkx Graph of (source, target, *weights) tuples
+    '''
+    g = nx.Graph()
+    if len(weight_names) == 1:
+        g.add_weighted_edges_from(edge_list)
+    else:
+        g.add_edges_from(
+            (source, target, dict(zip(weight_names, weights)))
+            for (source, target, *weights) in edge_list
+        )
+    return g
+
+
+def _get_conditions(notes_df, conditions):
+    '''
+    The list of conditions and the categorical condition column (or None)
+    of the conditions argument of TeamworkCorpus
+    '''
+    if conditions is None:
+        return [], None
+    if isinstance(conditions, str):
+        condition_column = conditions
+        conditions = [*pd.Categorical(notes_df[condition_column]).categories]
+    else:
+        (conditions, condition_column) = ([*conditions], None)
+    if len(conditions) > 63:
+        raise ValueError(f"at most 63 conditions are supported, got {len(conditions)}")
+    return conditions, condition_column
+
+
+def _get_note_columns(columns, conditions=None):
+    '''
+    Note columns read for a corpus: the corpus columns, then the condition
+    columns or the categorical condition column of conditions
+    '''
+    if conditions is None:
+        condition_columns = []
+    elif isinstance(conditions, str):
+        condition_columns = [conditions]
+    else:
+        condition_columns = [*conditions]
+    return [*dict.fromkeys([*columns.values()] + condition_columns)]
+
+
+def _get_condition_mask(notes_df, conditions, condition_column=None):
+    '''
+    Bitmask of the conditions of each note: bit i is set if the note is in
+    the cohort of conditions[i]. The conditions are boolean columns, or the
+    values of condition_column.
+    '''
+    mask = np.zeros(len(notes_df), dtype=np.int64)
+    if condition_column is not None:
+        values = notes_df[condition_column]
+        codes = pd.Index(conditions).get_indexer(values)
+        if ((codes == -1) & values.notna().to_numpy()).any():
+            unknown = pd.unique(values[(codes == -1) & values.notna().to_numpy()])
+            raise ValueError(f"unknown conditions in {condition_column}: {[*unknown]}")
+        has_condition = codes >= 0
+        mask[has_condition] = np.left_shift(1, codes[has_condition].astype(np.int64))
+        return mask
+    for (i, condition) in enumerate(conditions):
+        is_condition = notes_df[condition].fillna(False).to_numpy(dtype=bool)
+        mask |= is_condition.astype(np.int64) << i
+    return mask
+
+
+def _prepare_note_data(notes_df, columns, team_delta, first_day, authors=None):
     """
     Preprocessing notes data. 
     
@@ -146,21 +1396,58 @@ def _prepare_note_data(notes_df, columns, team_delta):
     add column for 'in-team' indicator.
     
     *UPDATE*: added team_condition column (index dx) as new criteria for care team
+
+    Normalized dates are stored as int32 day offsets from first_day (see
+    _to_day_offsets). Note authors and visit ids are encoded as integer
+    codes, which are used for all joins and edge keys. Returns the code
+    tables (arrays of author names and visit ids, indexed by code). If an
+    author table is passed, its codes are kept and new authors are appended
+    to it.
     """
     visit_id, admit_date, note_date, note_author, team_condition = [*columns.values()]
 
-    notes_df[NORM_ADMISSION_DATE] = notes_df[admit_date].dt.date
-    notes_df[NORM_NOTE_DATE] = notes_df[note_date].dt.date
+    notes_df[NORM_ADMISSION_DATE] = _to_day_offsets(notes_df[admit_date], first_day)
+    notes_df[NORM_NOTE_DATE] = _to_day_offsets(notes_df[note_date], first_day)
+    notes_df[team_condition] = (notes_df[team_condition] == True).fillna(False).astype(bool)
 
     # removed keep='first'. This was keeping the first duplicate, instead of removing all duplicates. 
+    # sort by note date first, so the earliest note of the day is the one kept
+    # whatever the order of the input rows
+    notes_df.sort_values(note_date, inplace=True, kind="stable")
     notes_df.drop_duplicates(
         [NORM_NOTE_DATE, note_author, visit_id], inplace=True
     )
-    notes_df.sort_values(admit_date, inplace=True)
+    notes_df.sort_values(admit_date, inplace=True, kind="stable")
     # add indicator column for whether the note author is in the care team
     notes_df[IS_IN_TEAM] = ((notes_df[note_date] - notes_df[admit_date] <= team_delta))
 
-def _get_edge_data(notes_df, columns, teamwork_delta, first_date):
+    if authors is None:
+        # sorted author codes keep the edge orientation of the author names
+        (author_codes, authors) = pd.factorize(notes_df[note_author], sort=True)
+    else:
+        (author_codes, authors) = _extend_codes(notes_df[note_author], authors)
+    (visit_codes, visit_ids) = pd.factorize(notes_df[visit_id])
+    authors = np.asarray(authors, dtype=object)
+    notes_df[AUTHOR_CODE] = author_codes.astype(np.int32)
+    notes_df[VISIT_CODE] = visit_codes.astype(np.int32)
+    notes_df[note_author] = pd.Categorical.from_codes(author_codes, authors)
+    return authors, np.asarray(visit_ids)
+
+
+def _extend_codes(values, table):
+    '''
+    Encode values by their position in table, appending unseen values
+    to the end of the table. Returns the codes and the extended table.
+    '''
+    codes = pd.Index(table).get_indexer(values)
+    unseen = codes == -1
+    if unseen.any():
+        new_values = pd.unique(values[unseen])
+        codes[unseen] = len(table) + pd.Index(new_values).get_indexer(values[unseen])
+        table = np.concatenate([table, new_values])
+    return codes, table
+
+def _get_edge_data(notes_df, columns, teamwork_delta, first_date, engine="pandas"):
     '''
     Create the experience edgelist, where each edge is a pair of note authors
     who wrote a note on the same day for a given patient visit.
@@ -168,75 +1455,399 @@ def _get_edge_data(notes_df, columns, teamwork_delta, first_date):
     This is used to calculate the experience of the careteam members who collaborated
     on patient visits. 
     '''
-    # get columns names needed for join
-    visit_id, *_, note_author, _ = [*columns.values()]
-    
-    # do self join on visit id and normalized note date to get table of edges
-    edges_df = notes_df.merge(
-        notes_df[[note_author, visit_id, IS_IN_TEAM, NORM_NOTE_DATE]],
-        how="inner",
-        on=[visit_id, NORM_NOTE_DATE],
+    *_, team_condition = [*columns.values()]
+    condition_columns = [team_condition]
+    if CONDITION_MASK in notes_df:
+        condition_columns.append(CONDITION_MASK)
+
+    # pair the notes of each visit and normalized note date
+    edges_df = _get_pair_data(
+        notes_df[_note_columns(columns) + condition_columns],
+        [VISIT_CODE, NORM_NOTE_DATE],
+        engine,
     )
-    # remove duplicate edges and add additional columns
     edges_df = _add_team_columns(edges_df, columns, teamwork_delta, first_date)
     return edges_df
 
 
-def _get_team_data(notes_df, columns, teamwork_delta, first_date):
+def _get_team_data(notes_df, columns, teamwork_delta, first_date, engine="pandas"):
     '''
     Create the  team edgelist, where each edge is a pair of note authors
     who wrote a note for a given patient visit.
     this defines the care team
     '''
-    visit_id, *_, note_author, team_condition = [*columns.values()]
-    # do self join on visit id get table of team edges
-    team_df = notes_df.merge(
-        notes_df[[note_author, visit_id, IS_IN_TEAM, NORM_NOTE_DATE, team_condition]],
-        how="inner",
-        on=visit_id,
-    )
-    # remove edges with the same name twice or with authors in reverse order
+    # pair the in-team authors of each visit, once per visit
+    notes_df = notes_df.loc[notes_df[IS_IN_TEAM], _note_columns(columns)]
+    notes_df = notes_df.drop_duplicates([VISIT_CODE, AUTHOR_CODE])
+    team_df = _get_pair_data(notes_df, [VISIT_CODE], engine)
     team_df = _add_team_columns(team_df, columns, teamwork_delta, first_date)
     # keep only edge in team and after initial teamwork window
     team_df = team_df[team_df[IS_IN_TEAM] & team_df[IS_AFTER_DELTA]]
     return team_df
 
 
+def _get_pair_data(notes_df, group_columns, engine="pandas"):
+    '''
+    Pair the notes of each group (rows with equal group_columns values) that
+    were written by different authors, once per unordered pair: the note of
+    the author with the lower code is the _x side, the other the _y side.
+
+    Notes in a group must have distinct authors. The pairs are generated as
+    row indices group by group, so no ordered cartesian product is built.
+    Groups keep the order of their first note.
+
+    With engine="polars" or "duckdb", the self-join runs as a multi-threaded
+    Polars lazy query or DuckDB SQL plan instead, and returns the same table.
+    '''
+    if engine == "polars":
+        return _get_pair_data_polars(notes_df, group_columns)
+    if engine == "duckdb":
+        return _get_pair_data_duckdb(notes_df, group_columns)
+    if engine != "pandas":
+        raise ValueError(f"unknown engine: {engine}")
+    groups = notes_df.groupby(group_columns, sort=False).ngroup().to_numpy()
+    order = np.lexsort((notes_df[AUTHOR_CODE].to_numpy(), groups))
+    (i, j) = _pair_indices(groups[order])
+    pairs_df = notes_df.iloc[order[i]].reset_index(drop=True)
+    pairs_df = pairs_df.rename(
+        columns={AUTHOR_CODE: AUTHOR_CODE_X, IS_IN_TEAM: IS_IN_TEAM_X}
+    )
+    pairs_df[AUTHOR_CODE_Y] = notes_df[AUTHOR_CODE].to_numpy()[order[j]]
+    pairs_df[IS_IN_TEAM_Y] = notes_df[IS_IN_TEAM].to_numpy()[order[j]]
+    return pairs_df
+
+
+def _get_pair_data_polars(notes_df, group_columns):
+    '''
+    _get_pair_data as a Polars lazy query. Requires polars.
+    '''
+    import polars as pl
+
+    notes = pl.from_pandas(_with_note_rows(notes_df)).lazy()
+    notes = notes.with_columns(pl.col(NOTE_ROW).min().over(group_columns).alias(GROUP_ROW))
+    pairs_df = (
+        notes.join(
+            notes.select([*group_columns, AUTHOR_CODE, IS_IN_TEAM]),
+            on=group_columns,
+            suffix="_y",
+        )
+        .filter(pl.col(AUTHOR_CODE) < pl.col(AUTHOR_CODE_Y))
+        .sort([GROUP_ROW, AUTHOR_CODE, AUTHOR_CODE_Y])
+        .collect()
+        .to_pandas()
+    )
+    return _as_pair_data(pairs_df, notes_df)
+
+
+def _get_pair_data_duckdb(notes_df, group_columns):
+    '''
+    _get_pair_data as an in-process DuckDB SQL plan. Requires duckdb.
+    '''
+    import duckdb
+
+    notes = _with_note_rows(notes_df)
+    partition = ", ".join(f'"{column}"' for column in group_columns)
+    on = " AND ".join(f'x."{column}" = y."{column}"' for column in group_columns)
+    query = f'''
+        WITH groups AS (
+            SELECT *, min("{NOTE_ROW}") OVER (PARTITION BY {partition}) AS "{GROUP_ROW}"
+            FROM notes
+        )
+        SELECT x.*,
+            y."{AUTHOR_CODE}" AS "{AUTHOR_CODE_Y}",
+            y."{IS_IN_TEAM}" AS "{IS_IN_TEAM_Y}"
+        FROM groups x JOIN groups y
+            ON {on} AND x."{AUTHOR_CODE}" < y."{AUTHOR_CODE}"
+        ORDER BY x."{GROUP_ROW}", x."{AUTHOR_CODE}", y."{AUTHOR_CODE}"
+    '''
+    with duckdb.connect() as connection:
+        connection.register("notes", notes)
+        pairs_df = connection.sql(query).df()
+    return _as_pair_data(pairs_df, notes_df)
+
+
+def _with_note_rows(notes_df):
+    '''
+    Copy of notes_df with the position of each note, to order the pairs
+    of the query engines as _get_pair_data does
+    '''
+    return notes_df.reset_index(drop=True).assign(**{NOTE_ROW: np.arange(len(notes_df))})
+
+
+def _as_pair_data(pairs_df, notes_df):
+    '''
+    Pair table of a query engine, with the columns and dtypes of the
+    pair table of _get_pair_data
+    '''
+    pairs_df = pairs_df.rename(
+        columns={AUTHOR_CODE: AUTHOR_CODE_X, IS_IN_TEAM: IS_IN_TEAM_X}
+    )
+    dtypes = notes_df.dtypes.rename(
+        {AUTHOR_CODE: AUTHOR_CODE_X, IS_IN_TEAM: IS_IN_TEAM_X}
+    )
+    dtypes[AUTHOR_CODE_Y] = notes_df.dtypes[AUTHOR_CODE]
+    dtypes[IS_IN_TEAM_Y] = notes_df.dtypes[IS_IN_TEAM]
+    return pairs_df[[*dtypes.index]].astype(dtypes.to_dict())
+
+
+def _pair_indices(groups):
+    '''
+    Indices (i, j), with i < j, of every pair of positions within the same
+    run of equal values of the sorted array groups
+    '''
+    n = len(groups)
+    bounds = np.append(np.flatnonzero(np.diff(groups, prepend=-1)), n)
+    ends = np.repeat(bounds[1:], np.diff(bounds))
+    # row i is paired with every later row of its group
+    n_pairs = ends - np.arange(n) - 1
+    i = np.repeat(np.arange(n), n_pairs)
+    first_pair = np.cumsum(n_pairs) - n_pairs
+    j = i + 1 + np.arange(len(i)) - np.repeat(first_pair, n_pairs)
+    return i, j
+
+
+def _note_columns(columns):
+    '''
+    Columns of the prepared notes kept in the pair tables
+    '''
+    _, admit_date, *_ = [*columns.values()]
+    return [
+        VISIT_CODE,
+        AUTHOR_CODE,
+        admit_date,
+        NORM_ADMISSION_DATE,
+        NORM_NOTE_DATE,
+        IS_IN_TEAM,
+    ]
+
 
 def _add_team_columns(df, columns, teamwork_delta, first_date):
     '''
-    Add additional columns and filter out extra rows.
+    Add additional columns to a pair table.
     Used in _get_edge_data and _get_team_data
     '''
-    _, admit_date, _, note_author, _ = [*columns.values()]
-    author_x = f"{note_author}_x"
-    author_y = f"{note_author}_y"
+    _, admit_date, *_ = [*columns.values()]
 
-    # remove edges with the same name twice or with authors in reverse order
-    df = df[df[author_x] < df[author_y]]
-    df[EDGE] = df[author_x] + df[author_y]
+    df[EDGE] = _edge_key(df[AUTHOR_CODE_X].to_numpy(), df[AUTHOR_CODE_Y].to_numpy())
 
     # might be able to remove this line, need to discuss
-    df[IS_IN_TEAM] = df[IS_IN_TEAM_X] & df[IS_IN_TEAM_Y]
+    df[IS_IN_TEAM] = df.pop(IS_IN_TEAM_X) & df.pop(IS_IN_TEAM_Y)
     # add column indicating whether there are 90 days prior to arrive date. if not, don't count as index team
     df[IS_AFTER_DELTA] = df[admit_date] > (first_date + teamwork_delta)
     return df
 
 
+def _build_edge_timelines(edge_df, first_day, counts=None):
+    '''
+    Build the timeline of every edge in the experience edgelist in bulk.
+
+    Rows are sorted by edge and note date once, and the runs of equal
+    (edge, date) values give the unique days and their note counts. All
+    timelines are views into the same three flat arrays.
+
+    Each row counts as one note, or as its row of the counts matrix, to
+    count notes in several columns (see _build_condition_timelines).
+    '''
+    edge_codes, edges = pd.factorize(edge_df[EDGE])
+    days = _from_day_offsets(edge_df[NORM_NOTE_DATE], first_day)
+    order = np.lexsort((days, edge_codes))
+    edge_codes, days = edge_codes[order], days[order]
+
+    # first row of every (edge, day) run, then first day of every edge
+    is_new_day = np.ones(len(days), dtype=bool)
+    is_new_day[1:] = (edge_codes[1:] != edge_codes[:-1]) | (days[1:] != days[:-1])
+    day_starts = np.flatnonzero(is_new_day)
+    edge_codes, days = edge_codes[day_starts], days[day_starts]
+    if counts is None:
+        cumcounts = np.append(day_starts, len(order))
+    else:
+        cumcounts = np.concatenate(
+            [np.zeros((1, counts.shape[1]), dtype=np.int64), np.cumsum(counts[order], axis=0)]
+        )[np.append(day_starts, len(order))]
+
+    edge_starts = np.flatnonzero(np.diff(edge_codes, prepend=-1))
+    return _unpack_timelines(
+        np.asarray(edges[edge_codes[edge_starts]]),
+        np.append(edge_starts, len(days)),
+        days,
+        cumcounts,
+    )
+
+
+def _build_condition_timelines(edge_df, n_conditions, first_day):
+    '''
+    Build the timelines of the edges of the experience edgelist with notes
+    in a condition cohort (see _get_condition_mask), with a column of
+    cumulative counts per condition
+    '''
+    if n_conditions == 0:
+        return dict()
+    masks = edge_df[CONDITION_MASK].to_numpy()
+    has_condition = masks != 0
+    counts = (masks[has_condition, None] >> np.arange(n_conditions)) & 1
+    return _build_edge_timelines(edge_df[has_condition], first_day, counts)
+
+
+def _unpack_timelines(edges, offsets, days, cumcounts):
+    '''
+    Build an edge dictionary from timelines stored in CSR layout: the days of
+    edges[i] are days[offsets[i]:offsets[i + 1]], and cumcounts is the running
+    count of notes over all the days (one entry longer than days).
+    The timelines are views into the arrays.
+    '''
+    return {
+        edge: EdgeTimeline(days[start:end], cumcounts[start : end + 1])
+        for (edge, start, end) in zip(edges.tolist(), offsets[:-1], offsets[1:])
+    }
+
+
+def _pack_timelines(edge_to_date_dict, count_shape=()):
+    '''
+    Store the timelines of an edge dictionary in CSR layout, sorted by edge.
+    Inverse of _unpack_timelines. count_shape is the shape of the counts of
+    a day, e.g. (n_conditions,) for condition timelines.
+    '''
+    edges = np.sort(np.fromiter(edge_to_date_dict, dtype=np.int64))
+    timelines = [edge_to_date_dict[edge] for edge in edges.tolist()]
+    offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum([len(t.days) for t in timelines], out=offsets[1:])
+    days = np.concatenate(
+        [t.days for t in timelines] + [np.array([], dtype="datetime64[D]")]
+    )
+    counts = np.concatenate(
+        [np.diff(t.cumcounts, axis=0) for t in timelines]
+        + [np.zeros((0, *count_shape), dtype=np.int64)]
+    )
+    cumcounts = np.concatenate(
+        [np.zeros((1, *count_shape)), np.cumsum(counts, axis=0)]
+    ).astype(np.int64)
+    return edges, offsets, days, cumcounts
+
+
+def _build_team_dicts(team_df, authors, visit_ids, first_day):
+    '''
+    Build the visit id to team edges and visit id to team dictionaries in bulk.
+
+    Each team edge is listed once per visit, in order of first appearance.
+    Team edges hold author codes; the teams hold author names.
+    '''
+    team_df = team_df[team_df[IS_IN_TEAM]].drop_duplicates([VISIT_CODE, EDGE])
+    visit_codes, visits = pd.factorize(team_df[VISIT_CODE])
+    order = np.argsort(visit_codes, kind="stable")
+    visit_codes = visit_codes[order]
+    dr_x = team_df[AUTHOR_CODE_X].to_numpy()[order]
+    dr_y = team_df[AUTHOR_CODE_Y].to_numpy()[order]
+    edge_items = list(
+        zip(
+            team_df[EDGE].to_numpy()[order],
+            zip(dr_x, dr_y),
+            _from_day_offsets(team_df[NORM_ADMISSION_DATE], first_day)[order],
+        )
+    )
+
+    bounds = np.append(np.flatnonzero(np.diff(visit_codes, prepend=-1)), len(order))
+    visit_id_to_edges_dict = dict()
+    visit_id_to_team_dict = dict()
+    for (visit, start, end) in zip(visit_ids[visits], bounds[:-1], bounds[1:]):
+        visit_id_to_edges_dict[visit] = edge_items[start:end]
+        visit_id_to_team_dict[visit] = set(
+            authors[np.union1d(dr_x[start:end], dr_y[start:end])]
+        )
+    return visit_id_to_edges_dict, visit_id_to_team_dict
+
+
+def _build_author_index(edges, n_authors):
+    '''
+    Index the edges of each author in CSR layout: the partners of author
+    code i are partners[offsets[i]:offsets[i + 1]], sorted by code, and
+    edge_index holds the position of each of those edges in edges
+    '''
+    (codes_x, codes_y) = _edge_authors(np.asarray(edges))
+    authors = np.concatenate([codes_x, codes_y])
+    partners = np.concatenate([codes_y, codes_x])
+    edge_index = np.tile(np.arange(len(edges)), 2)
+    order = np.lexsort((partners, authors))
+    offsets = np.zeros(n_authors + 1, dtype=np.int64)
+    np.cumsum(np.bincount(authors, minlength=n_authors), out=offsets[1:])
+    return offsets, partners[order], edge_index[order]
+
+
+def _pack_team_edges(visit_id_to_edges_dict, visit_ids):
+    '''
+    Store the team edges of every visit in CSR layout: the edge keys of
+    visits[i] are edges[offsets[i]:offsets[i + 1]], and admit_days[i] is its
+    admission day.
+    '''
+    visits = pd.Index(visit_ids).get_indexer([*visit_id_to_edges_dict])
+    offsets = np.zeros(len(visits) + 1, dtype=np.int64)
+    np.cumsum([len(items) for items in visit_id_to_edges_dict.values()], out=offsets[1:])
+    edges = np.array(
+        [item[0] for items in visit_id_to_edges_dict.values() for item in items],
+        dtype=np.int64,
+    )
+    admit_days = np.array(
+        [items[0][2] for items in visit_id_to_edges_dict.values()],
+        dtype="datetime64[D]",
+    )
+    return visits.astype(np.int64), offsets, edges, admit_days
+
+
+def _build_dicts_by_row(edge_df, team_df, columns, authors, visit_ids, first_day):
+    '''
+    Row by row reference implementation of _build_edge_timelines and
+    _build_team_dicts. Much slower; kept to test the bulk build against.
+    '''
+    edge_to_date_dict = dict()
+    dx_edge_to_date_dict = dict()
+    visit_id_to_edges_dict = dict()
+    visit_id_to_team_dict = dict()
+    edge_df.apply(
+        _add_edge_to_dicts,
+        axis="columns",
+        args=(edge_to_date_dict, dx_edge_to_date_dict, columns),
+    )
+    team_df.apply(
+        _add_team_to_dicts,
+        axis="columns",
+        args=(visit_id_to_edges_dict, visit_id_to_team_dict, columns),
+    )
+    visit_id_to_edges_dict = {
+        visit_ids[k]: [
+            (edge, codes, first_day + np.timedelta64(day, "D"))
+            for (edge, codes, day) in v
+        ]
+        for (k, v) in visit_id_to_edges_dict.items()
+    }
+    visit_id_to_team_dict = {
+        visit_ids[k]: set(authors[[*v]]) for (k, v) in visit_id_to_team_dict.items()
+    }
+    edge_to_date_dict = {
+        k: _to_timeline(_from_day_offsets(v, first_day))
+        for (k, v) in edge_to_date_dict.items()
+    }
+    dx_edge_to_date_dict = {
+        k: _to_timeline(_from_day_offsets(v, first_day))
+        for (k, v) in dx_edge_to_date_dict.items()
+    }
+    return (
+        edge_to_date_dict,
+        dx_edge_to_date_dict,
+        visit_id_to_edges_dict,
+        visit_id_to_team_dict,
+    )
+
+
 def _add_team_to_dicts(
     edge_record, visit_id_to_edges_dict, visit_id_to_team_dict, columns
 ):
     if not edge_record[IS_IN_TEAM]:
         return
-    visit_id, *_, note_author, _ = [*columns.values()]
-    author_x = f"{note_author}_x"
-    author_y = f"{note_author}_y"
-    edge_tup = (edge_record[author_x], edge_record[author_y])
+    edge_tup = (edge_record[AUTHOR_CODE_X], edge_record[AUTHOR_CODE_Y])
     
-    # store edge, individual note author names, and arrive date in list item
+    # store edge, individual note author codes, and arrive date in list item
     edge_list_item = (edge_record[EDGE], edge_tup, edge_record[NORM_ADMISSION_DATE])
-    visit_id_to_edges_dict.setdefault(edge_record[visit_id], []).append(edge_list_item)
-    visit_id_to_team_dict.setdefault(edge_record[visit_id], set()).update(edge_tup)
+    visit_id_to_edges_dict.setdefault(edge_record[VISIT_CODE], []).append(edge_list_item)
+    visit_id_to_team_dict.setdefault(edge_record[VISIT_CODE], set()).update(edge_tup)
 
 def _add_edge_to_dicts(edge_record, edge_to_date_dict, dx_edge_to_date_dict, columns):
     '''TODO: need separate dict for hf experience, and add edges here'''
@@ -249,12 +1860,607 @@ def _add_edge_to_dicts(edge_record, edge_to_date_dict, dx_edge_to_date_dict, col
                                                                      )
 
 
-def from_csv(filename, teamwork_delta=90, team_delta=2, **columns):
+def _to_timeline(note_dates):
+    '''
+    Convert the note dates of an edge into an EdgeTimeline: the sorted,
+    unique note days, and the cumulative number of notes before each day.
+    '''
+    days, counts = np.unique(
+        np.array(note_dates, dtype="datetime64[D]"), return_counts=True
+    )
+    return EdgeTimeline(days, np.concatenate(([0], np.cumsum(counts))))
+
+
+def _timelines_nbytes(timelines):
+    '''
+    Bytes held by a timeline dictionary, counting the arrays that the
+    timelines are views of once. The arrays of a _PackedTimelines are
+    counted with the packed indexes.
+    '''
+    if isinstance(timelines, _PackedTimelines):
+        return sys.getsizeof(timelines.cache) + sum(
+            sys.getsizeof(timeline) for timeline in timelines.cache.values()
+        )
+    nbytes = sys.getsizeof(timelines)
+    bases = dict()
+    for timeline in timelines.values():
+        nbytes += sys.getsizeof(timeline)
+        for array in timeline:
+            base = array if array.base is None else array.base
+            bases[id(base)] = base
+    return nbytes + sum(getattr(base, "nbytes", 0) for base in bases.values())
+
+
+def _team_dicts_nbytes(visit_id_to_edges_dict, visit_id_to_team_dict):
+    '''
+    Approximate bytes held by the team dictionaries: the dictionaries, their
+    lists, sets and edge tuples (author names and ids are shared). The
+    arrays of a _PackedTeamEdges are counted with the packed indexes.
+    '''
+    if isinstance(visit_id_to_edges_dict, _PackedTeamEdges):
+        return int(visit_id_to_edges_dict.index.memory_usage(deep=True))
+    nbytes = sys.getsizeof(visit_id_to_edges_dict) + sys.getsizeof(visit_id_to_team_dict)
+    for edge_items in visit_id_to_edges_dict.values():
+        nbytes += sys.getsizeof(edge_items)
+        nbytes += sum(sys.getsizeof(item) + sys.getsizeof(item[1]) for item in edge_items)
+    return nbytes + sum(sys.getsizeof(team) for team in visit_id_to_team_dict.values())
+
+
+def _edge_key(author_code_x, author_code_y):
+    '''
+    Pack the author codes of an edge into one int64 key
+    '''
+    return (author_code_x.astype(np.int64) << 32) | author_code_y
+
+
+def _edge_authors(edge_key):
+    '''
+    Unpack edge keys into the author codes of the edges
+    '''
+    return edge_key >> 32, edge_key & 0xFFFFFFFF
+
+
+def _count_in_window(timeline, start, end):
+    '''
+    Count the notes of an edge timeline written in the window [start, end),
+    using a binary search instead of scanning every note date.
+    '''
+    lo, hi = timeline.days.searchsorted([start, end])
+    return int(timeline.cumcounts[hi] - timeline.cumcounts[lo])
+
+
+def _day_keys(offsets, days):
+    '''
+    Sort keys for the days of CSR timelines: the index of each day's edge
+    and the day, packed into one int64, so that a single binary search can
+    find a day within the timeline of any edge
+    '''
+    edge_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return _day_key(edge_index, days)
+
+
+def _day_key(edge_index, days):
+    return (edge_index.astype(np.int64) << 32) | (
+        days.astype("datetime64[D]").astype(np.int64) + 2**31
+    )
+
+
+def _count_in_windows(packed_timelines, edges, starts, ends):
+    '''
+    Vectorized _count_in_window: count the notes of each of edges in its
+    window [starts[i], ends[i]), in CSR timelines with their day keys.
+    Edges with no timeline count 0. With condition timelines, the counts
+    have a column per condition.
+    '''
+    (keys, offsets, days, cumcounts, day_keys) = packed_timelines
+    edges = np.asarray(edges, dtype=np.int64)
+    if len(keys) == 0:
+        return np.zeros((len(edges), *np.shape(cumcounts)[1:]), dtype=np.int64)
+    edge_index = np.minimum(np.searchsorted(keys, edges), len(keys) - 1)
+    lo = np.searchsorted(day_keys, _day_key(edge_index, starts))
+    hi = np.searchsorted(day_keys, _day_key(edge_index, ends))
+    counts = np.asarray(cumcounts)[hi] - np.asarray(cumcounts)[lo]
+    counts[keys[edge_index] != edges] = 0
+    return counts
+
+
+def _merge_timeline(timeline, other):
+    '''
+    Merge the note days and counts of two timelines of the same edge
+    '''
+    days = np.concatenate([timeline.days, other.days])
+    counts = np.concatenate([np.diff(timeline.cumcounts), np.diff(other.cumcounts)])
+    order = np.argsort(days, kind="stable")
+    days, starts = np.unique(days[order], return_index=True)
+    counts = np.add.reduceat(counts[order], starts)
+    return EdgeTimeline(days, np.concatenate(([0], np.cumsum(counts))))
+
+
+def _merge_timelines(edge_to_date_dict, new_edge_to_date_dict):
+    '''
+    Merge new edge timelines into an edge dictionary, in place
+    '''
+    for (edge, timeline) in new_edge_to_date_dict.items():
+        if edge in edge_to_date_dict:
+            timeline = _merge_timeline(edge_to_date_dict[edge], timeline)
+        edge_to_date_dict[edge] = timeline
+
+
+def _replace_timelines(edge_to_date_dict, edges, new_edge_to_date_dict):
+    '''
+    Replace the timelines of edges in an edge dictionary, in place, with
+    their timelines in new_edge_to_date_dict. Edges not in it are removed.
+    '''
+    for edge in edges:
+        edge_to_date_dict.pop(edge, None)
+    edge_to_date_dict.update(new_edge_to_date_dict)
+
+
+def _trim_timelines(edge_to_date_dict, start):
+    '''
+    Drop the note days before start from an edge dictionary, in place.
+    Edges with no days left are removed.
+    '''
+    for edge in list(edge_to_date_dict):
+        timeline = edge_to_date_dict[edge]
+        i = timeline.days.searchsorted(start)
+        if i == len(timeline.days):
+            del edge_to_date_dict[edge]
+        elif i > 0:
+            # copy, so the trimmed days of the shared arrays can be freed
+            edge_to_date_dict[edge] = EdgeTimeline(
+                timeline.days[i:].copy(), timeline.cumcounts[i:].copy()
+            )
+
+
+def _to_day(date):
+    '''
+    The day of a date, as a datetime64[D]
+    '''
+    return np.datetime64(pd.Timestamp(date), "D")
+
+
+def _to_day_offsets(dates, first_day):
+    '''
+    Days from first_day to each of dates (a Series of timestamps), as int32
+    '''
+    days = dates.to_numpy().astype("datetime64[D]")
+    return (days - first_day).astype(np.int32)
+
+
+def _from_day_offsets(offsets, first_day):
+    '''
+    The days of offsets from first_day (see _to_day_offsets), as datetime64[D]
+    '''
+    return first_day + np.asarray(offsets).astype("timedelta64[D]")
+
+
+def _month_labels(dates):
+    '''
+    YYYY-MM labels of dates, as a categorical
+    '''
+    codes, months = pd.factorize(np.asarray(dates, dtype="datetime64[M]"))
+    return pd.Categorical.from_codes(codes, months.astype(str))
+
+
+def _write_parquet(df, path, partition_cols):
+    '''
+    Write df to a Parquet dataset, partitioned by partition_cols
+    (a single file if empty)
+    '''
+    if partition_cols:
+        df.to_parquet(path, partition_cols=[*partition_cols], index=False)
+    else:
+        df.to_parquet(path, index=False)
+
+
+def _as_note_dates(notes_df, columns):
+    '''
+    Convert the admission and note date columns to timestamps, if they
+    were not stored as timestamps
+    '''
+    for column in [columns[ADMISSION_DATE], columns[NOTE_DATE]]:
+        if not pd.api.types.is_datetime64_any_dtype(notes_df[column]):
+            notes_df[column] = pd.to_datetime(notes_df[column])
+    return notes_df
+
+
+def from_parquet(
+    filename,
+    teamwork_delta=90,
+    team_delta=2,
+    first_date=None,
+    conditions=None,
+    verbose=True,
+    n_jobs=1,
+    graph_type="networkx",
+    slim=False,
+    engine="pandas",
+    **columns,
+):
+    '''
+    Build a TeamworkCorpus from a notes Parquet file or dataset. Only the
+    corpus and condition columns are read, and timestamp columns are read
+    natively rather than parsed. The other arguments are passed to
+    TeamworkCorpus, and the keyword arguments are the column names.
+    Requires pyarrow.
+    '''
+    columns = {**default_columns, **columns}
+    notes_df = pd.read_parquet(filename, columns=_get_note_columns(columns, conditions))
+    notes_df = _as_note_dates(notes_df, columns)
+    return TeamworkCorpus(
+        notes_df,
+        teamwork_delta,
+        team_delta,
+        first_date,
+        n_jobs=n_jobs,
+        graph_type=graph_type,
+        verbose=verbose,
+        conditions=conditions,
+        slim=slim,
+        engine=engine,
+        **columns,
+    )
+
+
+def from_arrow(
+    table,
+    teamwork_delta=90,
+    team_delta=2,
+    first_date=None,
+    conditions=None,
+    verbose=True,
+    n_jobs=1,
+    graph_type="networkx",
+    slim=False,
+    engine="pandas",
+    **columns,
+):
+    '''
+    Build a TeamworkCorpus from a pyarrow Table (or RecordBatch) of notes.
+    Only the corpus and condition columns are converted to pandas. The
+    other arguments are passed to TeamworkCorpus, and the keyword arguments
+    are the column names.
+    '''
+    columns = {**default_columns, **columns}
+    notes_df = table.select(_get_note_columns(columns, conditions)).to_pandas()
+    notes_df = _as_note_dates(notes_df, columns)
+    return TeamworkCorpus(
+        notes_df,
+        teamwork_delta,
+        team_delta,
+        first_date,
+        n_jobs=n_jobs,
+        graph_type=graph_type,
+        verbose=verbose,
+        conditions=conditions,
+        slim=slim,
+        engine=engine,
+        **columns,
+    )
+
+
+def from_csv(
+    filename,
+    teamwork_delta=90,
+    team_delta=2,
+    chunksize=None,
+    first_date=None,
+    engine="pandas",
+    conditions=None,
+    verbose=True,
+    n_jobs=1,
+    graph_type="networkx",
+    slim=False,
+    **columns,
+):
+    '''
+    Build a TeamworkCorpus from a notes CSV file. Only the corpus and
+    condition columns are read. The other arguments are passed to
+    TeamworkCorpus, and the keyword arguments are the column names.
+
+    If chunksize is set, the file is streamed instead (see iter_csv), and an
+    iterator of (visit id, team experience) pairs is returned. Streaming
+    does not support conditions, and builds no corpus to pass verbose,
+    n_jobs, graph_type or slim to.
+    '''
+    if chunksize is not None:
+        if conditions is not None:
+            raise ValueError("conditions are not supported when streaming a CSV file")
+        return iter_csv(
+            filename, chunksize, teamwork_delta, team_delta, first_date, engine, **columns
+        )
     columns = {**default_columns, **columns}
     notes_df = pd.read_csv(
-        filename, parse_dates=[ADMISSION_DATE, NOTE_DATE], usecols=columns.values()
+        filename,
+        parse_dates=[columns[ADMISSION_DATE], columns[NOTE_DATE]],
+        usecols=_get_note_columns(columns, conditions),
+    )
+    return TeamworkCorpus(
+        notes_df,
+        teamwork_delta,
+        team_delta,
+        first_date,
+        n_jobs=n_jobs,
+        graph_type=graph_type,
+        verbose=verbose,
+        conditions=conditions,
+        slim=slim,
+        engine=engine,
+        **columns,
     )
-    return TeamworkCorpus(notes_df, teamwork_delta, team_delta, columns)
+
+
+def iter_csv(
+    filename,
+    chunksize,
+    teamwork_window=90,
+    team_window=2,
+    first_date=None,
+    engine="pandas",
+    **columns,
+):
+    '''
+    Stream the team experience of each visit from a notes CSV file that is
+    too large to load at once. The file must be sorted by note date.
+
+    The file is read chunksize rows at a time and the edge timelines are
+    built incrementally. A visit is scored and yielded, as a
+    (visit id, team experience) pair, once every note that can be in its
+    care team has been read. Only the teamwork window of edge history
+    needed by the visits still to be scored is kept, so memory is bounded
+    by the window rather than by the size of the file.
+
+    The start of the corpus defaults to the first admission date in the
+    first chunk.
+    '''
+    columns = {**default_columns, **columns}
+    visit_id, admit_date, note_date, _, team_condition = [*columns.values()]
+    teamwork_deltas = _get_teamwork_deltas(teamwork_window)
+    # history is kept for the longest window
+    teamwork_delta = max(teamwork_deltas)
+    team_delta = timedelta(days=team_window)
+    reader = pd.read_csv(
+        filename,
+        parse_dates=[admit_date, note_date],
+        usecols=[*columns.values()],
+        chunksize=chunksize,
+    )
+
+    authors = np.array([], dtype=object)
+    edge_to_date_dict = dict()
+    dx_edge_to_date_dict = dict()
+    open_notes = []  # in-team notes of the visits not yet scored
+    history_start = None
+    for (notes_df, last_day) in _iter_note_days(reader, note_date):
+        if len(notes_df) > 0:
+            if first_date is None:
+                first_date = notes_df[admit_date].min()
+            first_date = pd.Timestamp(first_date)
+            (authors, _) = _prepare_note_data(
+                notes_df, columns, team_delta, _to_day(first_date), authors
+            )
+
+            edge_df = _get_edge_data(
+                notes_df, columns, teamwork_delta, first_date, engine
+            )
+            _merge_timelines(
+                edge_to_date_dict, _build_edge_timelines(edge_df, _to_day(first_date))
+            )
+            _merge_timelines(
+                dx_edge_to_date_dict,
+                _build_edge_timelines(
+                    edge_df[edge_df[team_condition] == True], _to_day(first_date)
+                ),
+            )
+            open_notes.append(notes_df[notes_df[IS_IN_TEAM]])
+        notes_df = pd.concat(open_notes)
+
+        # the last day a note can be in a visit's team has been read
+        if last_day is None:
+            is_ready = np.ones(len(notes_df), dtype=bool)
+        else:
+            team_end = (notes_df[admit_date] + team_delta).dt.normalize()
+            is_ready = (team_end <= pd.Timestamp(last_day)).to_numpy()
+        ready_df = notes_df[is_ready]
+        open_notes = [notes_df[~is_ready]]
+
+        if len(ready_df) > 0:
+            ready_df[VISIT_CODE], visit_ids = pd.factorize(ready_df[visit_id])
+            team_df = _get_team_data(
+                ready_df, columns, teamwork_delta, first_date, engine
+            )
+            team_df = team_df.sort_values(admit_date, kind="stable")
+            (visit_id_to_edges_dict, visit_id_to_team_dict) = _build_team_dicts(
+                team_df, authors, visit_ids, _to_day(first_date)
+            )
+            for (visit, edge_items) in visit_id_to_edges_dict.items():
+                yield visit, _get_team_experience(
+                    edge_items,
+                    visit_id_to_team_dict[visit],
+                    authors,
+                    edge_to_date_dict,
+                    dx_edge_to_date_dict,
+                    teamwork_deltas,
+                )
+
+        if last_day is None:
+            return
+        # visits still to be scored were admitted on or after this day
+        next_admit_day = last_day + 1 - np.timedelta64(team_window, "D")
+        if len(open_notes[0]) > 0:
+            next_admit_day = min(
+                next_admit_day,
+                _to_day(first_date)
+                + np.timedelta64(open_notes[0][NORM_ADMISSION_DATE].min(), "D"),
+            )
+        start = next_admit_day - teamwork_delta
+        if history_start is None or start - history_start >= teamwork_delta:
+            _trim_timelines(edge_to_date_dict, start)
+            _trim_timelines(dx_edge_to_date_dict, start)
+            history_start = start
+
+
+def build_sharded(
+    notes_df,
+    shard_by="month",
+    teamwork_window=90,
+    team_window=2,
+    first_date=None,
+    n_jobs=1,
+    verbose=True,
+    **kwargs,
+):
+    '''
+    Build the team experience of every visit shard by shard, and merge the
+    shards into one dict of visit id to team experience, equal to the
+    team_experience_dict of a TeamworkCorpus built from all of notes_df.
+
+    Visits are sharded by month of admission, or by the values of the
+    column shard_by (see get_visit_shards). Each shard is built as its own
+    TeamworkCorpus from its visits' notes plus the notes written in the
+    teamwork window before its admissions (see get_shard_notes), so only
+    one window of history overlaps between adjacent shards. Shards are
+    built in n_jobs forked processes; to build them on separate machines,
+    run build_shard on each get_shard_notes with the same first_date.
+
+    Other keyword arguments (columns, conditions, graph_type) are passed to
+    TeamworkCorpus.
+    '''
+    columns = {**default_columns, **{k: kwargs[k] for k in default_columns if k in kwargs}}
+    if first_date is None:
+        first_date = notes_df[columns[ADMISSION_DATE]].min()
+    condition_column = kwargs.get("conditions")
+    if isinstance(condition_column, str):
+        # every shard gets the conditions of the whole corpus
+        notes_df = notes_df.assign(
+            **{condition_column: pd.Categorical(notes_df[condition_column])}
+        )
+    visit_shards = get_visit_shards(notes_df, shard_by, **columns)
+
+    def process(shard):
+        shard_notes_df = get_shard_notes(
+            notes_df, visit_shards, shard, teamwork_window, **columns
+        )
+        visit_ids = visit_shards.index[_is_in_shard(visit_shards, shard)]
+        return build_shard(
+            shard_notes_df, visit_ids, teamwork_window, team_window, first_date, **kwargs
+        )
+
+    # visits with a missing shard_by value make up a shard of their own
+    shards = [*pd.unique(visit_shards)]
+    n_shard_visits = sum(_is_in_shard(visit_shards, shard).sum() for shard in shards)
+    if n_shard_visits != len(visit_shards):
+        raise ValueError(
+            f"{len(visit_shards) - n_shard_visits} visits are not in any shard"
+        )
+    team_experience = dict()
+    for shard_team_experience in _map_in_processes(process, shards, n_jobs, verbose):
+        team_experience.update(shard_team_experience)
+    return team_experience
+
+
+def get_visit_shards(notes_df, shard_by="month", **columns):
+    '''
+    Shard of every visit, as a Series indexed by visit id, in order of
+    admission: the month of admission, or the value of the column shard_by
+    (e.g. a facility) in the visit's first note, which may be missing
+    '''
+    columns = {**default_columns, **columns}
+    visit_id, admit_date, *_ = [*columns.values()]
+    notes_df = notes_df.sort_values(admit_date, kind="stable")
+    if shard_by == "month":
+        shards = notes_df[admit_date].dt.to_period("M")
+    else:
+        shards = notes_df[shard_by]
+    is_first_note = ~notes_df[visit_id].duplicated().to_numpy()
+    return pd.Series(
+        shards.to_numpy()[is_first_note],
+        index=notes_df[visit_id].to_numpy()[is_first_note],
+        dtype=shards.dtype,
+    )
+
+
+def get_shard_notes(notes_df, visit_shards, shard, teamwork_window=90, **columns):
+    '''
+    Notes needed to build the team experience of the visits of a shard:
+    their own notes, and every note written from the longest teamwork
+    window before the shard's first admission day up to its last one
+    '''
+    columns = {**default_columns, **columns}
+    visit_id, admit_date, note_date, *_ = [*columns.values()]
+    history_delta = pd.Timedelta(max(_get_teamwork_deltas(teamwork_window)))
+    is_shard_visit = notes_df[visit_id].isin(
+        visit_shards.index[_is_in_shard(visit_shards, shard)]
+    )
+    admit_days = notes_df.loc[is_shard_visit, admit_date].dt.normalize()
+    note_days = notes_df[note_date].dt.normalize()
+    is_history = (note_days >= admit_days.min() - history_delta) & (
+        note_days < admit_days.max()
+    )
+    return notes_df[is_shard_visit | is_history]
+
+
+def build_shard(
+    shard_notes_df, visit_ids, teamwork_window=90, team_window=2, first_date=None, **kwargs
+):
+    '''
+    Team experience of visit_ids, from the notes of their shard (see
+    get_shard_notes). first_date must be the start of the whole corpus, so
+    that every shard keeps the same visits as the monolithic build.
+    '''
+    corpus = TeamworkCorpus(
+        shard_notes_df,
+        teamwork_window,
+        team_window,
+        first_date,
+        cache_size=0,
+        verbose=False,
+        **kwargs,
+    )
+    return {
+        visit: corpus.team_experience_dict[visit]
+        for visit in visit_ids
+        if visit in corpus.team_experience_dict
+    }
+
+
+def _is_in_shard(visit_shards, shard):
+    '''
+    Whether each visit of visit_shards is in shard; a missing shard
+    value is a shard of the visits with a missing value
+    '''
+    if pd.isna(shard):
+        return visit_shards.isna().to_numpy()
+    return (visit_shards == shard).fillna(False).to_numpy(dtype=bool)
+
+
+def _iter_note_days(reader, note_date):
+    '''
+    Regroup chunks of notes sorted by note date so that every note of a day
+    is in the same chunk. Yields each chunk with its last note day; the
+    last day is None for the final chunk.
+    '''
+    carry = None
+    last_day = None
+    for chunk in reader:
+        if len(chunk) == 0:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        days = chunk[note_date].to_numpy().astype("datetime64[D]")
+        if last_day is not None and (days <= last_day).any():
+            raise ValueError(f"notes must be sorted by {note_date}")
+        if (np.diff(days) < np.timedelta64(0, "D")).any():
+            raise ValueError(f"notes must be sorted by {note_date}")
+        # hold back the notes of the newest day, which may continue in the next chunk
+        is_complete = days < days[-1]
+        carry = chunk[~is_complete]
+        if is_complete.any():
+            last_day = days[is_complete][-1]
+            yield chunk[is_complete], last_day
+    if carry is not None:
+        yield carry, None
 
 
 """Static Column Names"""
@@ -269,7 +2475,26 @@ IS_IN_TEAM = "is_in_team"
 IS_IN_TEAM_X = f"{IS_IN_TEAM}_x"
 IS_IN_TEAM_Y = f"{IS_IN_TEAM}_y"
 EDGE = "edge"
+AUTHOR_CODE = "author_code"
+AUTHOR_CODE_X = f"{AUTHOR_CODE}_x"
+AUTHOR_CODE_Y = f"{AUTHOR_CODE}_y"
+VISIT_CODE = "visit_code"
+CONDITION_MASK = "condition_mask"
+ADMIT_MONTH = "admit_month"
 IS_AFTER_DELTA = "is_after_delta"
+NOTE_ROW = "note_row"
+GROUP_ROW = "group_row"
+
+# wall time (seconds), output rows and process peak RSS (MB) after a build stage
+StageStats = namedtuple("StageStats", ["stage", "seconds", "rows", "peak_rss_mb"])
+
+# format version of the index written by TeamworkCorpus.save
+INDEX_VERSION = 1
+INDEX_META_FILE = "index.json"
+
+# an edge's note days, sorted and unique, with cumcounts[i] holding the number
+# of notes written before days[i] (cumcounts has one more entry than days)
+EdgeTimeline = namedtuple("EdgeTimeline", ["days", "cumcounts"])
 
 default_columns = {
     VISIT_ID: "id",
@@ -11,39 +11,114 @@ import gender_guesser.detector as gender
 import pickle
 import networkx as nx
 from itertools import combinations
+from teamwork import teamwork as tw
+
+# first name of "Last, First" names, else the first word of the name
+FIRST_NAME_AFTER_COMMA = re.compile(r"(?<=,\s)\w+")
+FIRST_WORD = re.compile(r"\w+")
+FEMALE_LABEL = re.compile(r".*female.*")
+MALE_LABEL = re.compile(r".*male.*")
+KNOWN_SEX = re.compile("[MF]")
+
+@functools.lru_cache(maxsize=None)
+def get_gender_detector():
+    '''
+    The gender_guesser detector, created on first use (loading its name
+    data takes a while)
+    '''
+    return gender.Detector()
 
 def detect_gender(name: str):
-    match = re.search(r"(?<=,\s)\w+", name)
+    match = FIRST_NAME_AFTER_COMMA.search(name)
     if match is None:
-        match = re.search(r"\w+", name)
+        match = FIRST_WORD.search(name)
     first_name = match.group()
-    result = gender_detector.get_gender(first_name)
+    return detect_gender_for_first_name(first_name)
+
+@functools.lru_cache(maxsize=None)
+def detect_gender_for_first_name(first_name: str):
+    '''
+    Gender label of a first name, memoized since many providers share
+    first names
+    '''
+    result = get_gender_detector().get_gender(first_name)
     return get_gender_label(result)
 
 def get_gender_label(result: str):
-    if re.match(r".*female.*", result):
+    if FEMALE_LABEL.match(result):
         return "F"
-    elif re.match(r".*male.*", result):
+    elif MALE_LABEL.match(result):
         return "M"
     else: return "U"
     
 def get_gender_for_row(row):
     sex = row['sex']
-    if sex is not None and re.match("[MF]", sex):
+    if sex is not None and KNOWN_SEX.match(sex):
         return sex
     else: return detect_gender(row['prov_name'])
+
+def get_guessed_genders(prov_demo_df):
+    '''
+    Vectorized get_gender_for_row: the recorded sex if it is M or F, else
+    the gender guessed from the first name. First names are extracted with
+    vectorized string operations and each unique first name is looked up
+    once.
+    '''
+    names = prov_demo_df['prov_name'].astype(str)
+    first_names = names.str.extract(f"({FIRST_NAME_AFTER_COMMA.pattern})", expand=False)
+    first_names = first_names.fillna(
+        names.str.extract(f"({FIRST_WORD.pattern})", expand=False)
+    )
+    unique_names = first_names.dropna().unique()
+    labels = first_names.map(
+        dict(zip(unique_names, map(detect_gender_for_first_name, unique_names)))
+    )
+    sex = prov_demo_df['sex']
+    has_sex = sex.notna() & sex.astype(str).str.match(KNOWN_SEX.pattern)
+    return sex.where(has_sex, labels)
     
-def get_prov_demo_dict(prov_demo_filename):   
+def get_prov_demo_dict(prov_demo_filename, cache_filename=None):
+    '''
+    Provider demographics by provider id, with the sex guessed from the
+    first name where it is not recorded.
+
+    With cache_filename, the dict is pickled there and reused by later
+    calls, as long as the provider file has not changed.
+    '''
+    if cache_filename is not None:
+        source = _get_file_signature(prov_demo_filename)
+        if os.path.exists(cache_filename):
+            with open(cache_filename, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['source'] == source:
+                return cached['prov_demo_dict']
+
     prov_demo_df = pd.read_csv(prov_demo_filename)
     prov_demo_df = prov_demo_df.dropna(subset=['prov_name', 'author_prov_id'])
     prov_demo_df['sex'] = prov_demo_df['sex'].fillna("U")
     prov_demo_df['clinician_title'] = prov_demo_df['clinician_title'].fillna("UNKNOWN")
-    prov_demo_df['guessed_sex'] = prov_demo_df.apply(get_gender_for_row, axis="columns")
+    prov_demo_df['guessed_sex'] = get_guessed_genders(prov_demo_df)
     
-    prov_demo_df = prov_demo_df.set_index('author_prov_id')
-    prov_demo_dict = prov_demo_df.to_dict('index')
+    # built from column lists, which is much faster than to_dict('index')
+    columns = [col for col in prov_demo_df.columns if col != 'author_prov_id']
+    rows = zip(*[prov_demo_df[col].tolist() for col in columns])
+    prov_demo_dict = dict(zip(
+        prov_demo_df['author_prov_id'].tolist(),
+        (dict(zip(columns, row)) for row in rows),
+    ))
+
+    if cache_filename is not None:
+        with open(cache_filename, 'wb') as f:
+            pickle.dump({'source': source, 'prov_demo_dict': prov_demo_dict}, f)
     return prov_demo_dict
 
+def _get_file_signature(filename):
+    '''
+    Path, size and modification time of a file, to detect changes
+    '''
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
 def get_dept_dict(dept_filename):
     dept_df = pd.read_csv(dept_filename)
     dept_df = dept_df.set_index('enc_csn_id')
@@ -111,4 +186,282 @@ def get_output_for_row(g, dx_g, visit_id, team, dept_dict, prov_demo_dict):
     
     data = {**data, **dept_dict[int(visit_id)]}
     
-    return data
\ No newline at end of file
+    return data
+
+def get_outputs(corpus, dept_dict, prov_demo_dict, n_jobs=None):
+    '''
+    Run get_output_for_row for every visit of a TeamworkCorpus, sharded
+    across n_jobs worker processes (default: the corpus n_jobs).
+    Returns one DataFrame with a row per visit.
+
+    With several teamwork windows, the experience columns (WINDOW_COLUMNS)
+    are also computed for each window, suffixed with _<window>. With
+    conditions, the dx experience columns are also computed for each
+    condition graph (CONDITION_COLUMNS, with the condition for dx).
+    '''
+    window_names = corpus.weight_names[1:]
+
+    def get_output(visit_id, item):
+        graphs = {'': item['graph'], 'dx_': item['dx_graph']}
+        for condition, condition_g in item.get('condition_graphs', {}).items():
+            graphs[f'{condition}_'] = condition_g
+        graphs = {
+            prefix: g if isinstance(g, nx.Graph) else g.to_networkx()
+            for prefix, g in graphs.items()
+        }
+        data = None
+        for name in corpus.weight_names:
+            suffix = name[len('weight'):]
+            window_graphs = graphs
+            if window_names:
+                window_graphs = {
+                    prefix: _get_window_graph(g, name) for prefix, g in graphs.items()
+                }
+            row = get_output_for_row(
+                window_graphs[''], window_graphs['dx_'],
+                visit_id, item['team'], dept_dict, prov_demo_dict
+            )
+            if data is None:
+                data = row
+            else:
+                data.update({f'{col}{suffix}': row[col] for col in WINDOW_COLUMNS})
+            for condition in corpus.conditions:
+                row = get_output_for_row(
+                    window_graphs[''], window_graphs[f'{condition}_'],
+                    visit_id, item['team'], dept_dict, prov_demo_dict
+                )
+                data.update({
+                    col.format(f'{condition}_') + suffix: row[col.format('dx_')]
+                    for col in CONDITION_COLUMNS
+                })
+        return data
+
+    return pd.DataFrame(corpus.map_visits(get_output, n_jobs))
+
+def get_output_df(corpus, dept_dict, prov_demo_dict):
+    '''
+    Batch version of get_output_for_row: the same output columns for every
+    visit of a TeamworkCorpus, in one DataFrame.
+
+    The team edge weights of all visits come from one vectorized lookup
+    (TeamworkCorpus.team_edges_df), and the team sizes, experience sums and
+    gender counts are grouped sums over those arrays. The clustering
+    coefficients of all team graphs are computed at once by
+    get_batch_clustering.
+
+    With several teamwork windows, the experience columns (WINDOW_COLUMNS)
+    are also computed for each window, suffixed with _<window>. With
+    conditions, the dx experience columns are also computed for each
+    condition (CONDITION_COLUMNS, with the condition for dx).
+    '''
+    edges_df = corpus.team_edges_df()
+    visit_codes, visit_ids = pd.factorize(edges_df['visit_id'])
+    n_visits = len(visit_ids)
+    codes_x = edges_df['source'].cat.codes.to_numpy()
+    codes_y = edges_df['target'].cat.codes.to_numpy()
+    authors = edges_df['source'].cat.categories
+
+    # team members: the unique authors of each visit's team edges
+    members = np.unique(
+        np.concatenate([
+            (visit_codes.astype(np.int64) << 32) | codes_x,
+            (visit_codes.astype(np.int64) << 32) | codes_y,
+        ])
+    )
+    member_visits = members >> 32
+    member_authors = members & 0xFFFFFFFF
+    team_size = np.bincount(member_visits, minlength=n_visits)
+
+    potential_edges = team_size * (team_size - 1) // 2
+    data = pd.DataFrame({'visit_id': visit_ids})
+    data['team_size'] = team_size
+    data['potential_edges'] = potential_edges
+    prefixes = ['', 'dx_'] + [f'{condition}_' for condition in corpus.conditions]
+    window_data = {}
+    for name in corpus.weight_names:
+        suffix = name[len('weight'):]
+        if name != 'weight' and name == corpus.weight_names[1]:
+            # the first window is the main weight
+            window_data[suffix] = window_data['']
+            continue
+        columns = {}
+        for prefix in prefixes:
+            weights = edges_df[prefix + name].to_numpy()
+            (clust_sum, clust_len) = _get_clustering_sums(
+                visit_codes, n_visits, codes_x, codes_y, weights
+            )
+            with np.errstate(invalid='ignore', divide='ignore'):
+                columns[f'avg_{prefix}clust'] = np.where(clust_len > 0, clust_sum / clust_len, 0)
+            columns[f'sum_{prefix}clust'] = clust_sum
+            columns[f'{prefix}experience'] = np.bincount(
+                visit_codes, weights=weights, minlength=n_visits
+            )
+            if prefix == '':
+                columns['team_edge_size'] = np.bincount(
+                    visit_codes, weights=weights > 0, minlength=n_visits
+                ).astype(np.int64)
+        columns['cumulative_experience'] = columns['experience'] - columns['team_edge_size']
+        columns['avg_cumulative_experience'] = columns['cumulative_experience'] / potential_edges
+        for prefix in prefixes[1:]:
+            columns[f'cumulative_{prefix}experience'] = columns[f'{prefix}experience']
+            columns[f'avg_cumulative_{prefix}experience'] = (
+                columns[f'cumulative_{prefix}experience'] / potential_edges
+            )
+        window_data[suffix] = columns
+    for col in WINDOW_COLUMNS:
+        data[col] = window_data[''][col]
+
+    # only team members are looked up, as in get_output_for_row
+    (team_authors, member_team_authors) = np.unique(member_authors, return_inverse=True)
+    for prefix, demo_col in [('', 'sex'), ('guessed_', 'guessed_sex')]:
+        member_genders = np.array(
+            [prov_demo_dict[prov][demo_col] for prov in authors[team_authors]], dtype=object
+        )[member_team_authors]
+        gen_count = np.bincount(
+            member_visits, weights=member_genders != 'U', minlength=n_visits
+        ).astype(np.int64)
+        fem_count = np.bincount(
+            member_visits, weights=member_genders == 'F', minlength=n_visits
+        ).astype(np.int64)
+        data[f'{prefix}gen_count'] = gen_count
+        data[f'{prefix}fem_count'] = fem_count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data[f'{prefix}gender_ratio'] = np.where(gen_count > 0, fem_count / gen_count, 0)
+
+    dept_df = pd.DataFrame.from_dict(dept_dict, orient='index')
+    dept_df = dept_df.loc[visit_ids.astype(int)].reset_index(drop=True)
+    data = data[OUTPUT_COLUMNS].drop(columns=dept_df.columns, errors='ignore')
+    extra_columns = {}
+    for suffix, columns in window_data.items():
+        if suffix:
+            extra_columns.update({f'{col}{suffix}': columns[col] for col in WINDOW_COLUMNS})
+        for condition in corpus.conditions:
+            extra_columns.update({
+                col.format(f'{condition}_') + suffix: columns[col.format(f'{condition}_')]
+                for col in CONDITION_COLUMNS
+            })
+    extra_df = pd.DataFrame(extra_columns, index=data.index)
+    return pd.concat([data, dept_df, extra_df], axis='columns')
+
+def output_to_parquet(output_df, corpus, path, partition_cols=('admit_month',)):
+    '''
+    Write an output table of get_outputs or get_output_df to a Parquet
+    dataset in the directory path, with the admission date of each visit,
+    partitioned by partition_cols (by default by month of admission).
+    Requires pyarrow.
+    '''
+    admit_dates = corpus.admission_dates()
+    output_df = output_df.assign(
+        admit_date=admit_dates.loc[output_df['visit_id']].to_numpy()
+    )
+    output_df[tw.ADMIT_MONTH] = tw._month_labels(output_df['admit_date'])
+    tw._write_parquet(output_df, path, partition_cols)
+
+def _get_window_graph(g, weight):
+    '''
+    Graph of the edges of g with a positive weight attribute, weighted by
+    it, as the team graph of a corpus built with that window alone
+    '''
+    window_g = nx.Graph()
+    window_g.add_weighted_edges_from(
+        (source, target, w) for (source, target, w) in g.edges(data=weight) if w > 0
+    )
+    return window_g
+
+def _get_clustering_sums(visit_codes, n_visits, sources, targets, weights):
+    '''
+    Sum and count of the weighted clustering coefficients of each visit's
+    graph, built from the visit's edges with a positive weight, as in the
+    graphs of TeamworkCorpus.team_experience_dict.
+    '''
+    has_weight = weights > 0
+    (node_visits, _, clustering) = get_batch_clustering(
+        visit_codes[has_weight], sources[has_weight], targets[has_weight],
+        weights[has_weight]
+    )
+    clust_sum = np.bincount(node_visits, weights=clustering, minlength=n_visits)
+    clust_len = np.bincount(node_visits, minlength=n_visits)
+    return clust_sum, clust_len
+
+def get_batch_clustering(graph_codes, sources, targets, weights):
+    '''
+    Weighted clustering coefficient of every node of many small graphs, in
+    one vectorized pass instead of one nx.clustering(g, weight='weight')
+    call per graph, with the same result to float tolerance.
+
+    Graph graph_codes[i] has the edge (sources[i], targets[i]) with the
+    positive weight weights[i]. The graphs are packed, by number of nodes,
+    into dense adjacency tensors of the cube roots of their weights
+    normalized by the graph's max weight, W, and the clustering of node u is
+    (W^3)[u, u] / (deg(u) * (deg(u) - 1)).
+
+    Returns the graph code, node and clustering of every node, sorted by
+    graph code.
+    '''
+    graph_codes = np.asarray(graph_codes, dtype=np.int64)
+    weights = np.asarray(weights, dtype=float)
+    n_edges = len(weights)
+    (node_codes, nodes) = pd.factorize(
+        np.concatenate([np.asarray(sources), np.asarray(targets)])
+    )
+    (members, member_index) = np.unique(
+        (np.tile(graph_codes, 2) << 32) | node_codes, return_inverse=True
+    )
+    member_graphs = members >> 32
+    (graphs, first_member, sizes) = np.unique(
+        member_graphs, return_index=True, return_counts=True
+    )
+    # position of each node in its graph's adjacency matrix
+    local = np.arange(len(members)) - np.repeat(first_member, sizes)
+    (i, j) = (local[member_index[:n_edges]], local[member_index[n_edges:]])
+    edge_graphs = np.searchsorted(graphs, graph_codes)
+    max_weights = np.zeros(len(graphs))
+    np.maximum.at(max_weights, edge_graphs, weights)
+    scaled = np.cbrt(weights / max_weights[edge_graphs])
+
+    clustering = np.zeros(len(members))
+    # graphs of fewer than 3 nodes have no triangles
+    for size in np.unique(sizes[sizes > 2]):
+        batch = np.flatnonzero(sizes == size)
+        n_batches = -(-len(batch) * size * size // CLUSTERING_BATCH_SIZE)
+        for batch in np.array_split(batch, n_batches):
+            position = np.full(len(graphs), -1)
+            position[batch] = np.arange(len(batch))
+            is_in_batch = position[edge_graphs] >= 0
+            g = position[edge_graphs[is_in_batch]]
+            adjacency = np.zeros((len(batch), size, size))
+            adjacency[g, i[is_in_batch], j[is_in_batch]] = scaled[is_in_batch]
+            adjacency[g, j[is_in_batch], i[is_in_batch]] = scaled[is_in_batch]
+            triangles = ((adjacency @ adjacency) * adjacency).sum(axis=2)
+            degree = (adjacency > 0).sum(axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                batch_clustering = np.where(
+                    degree > 1, triangles / (degree * (degree - 1)), 0
+                )
+            clustering[first_member[batch][:, None] + np.arange(size)] = batch_clustering
+    return member_graphs, np.asarray(nodes)[members & 0xFFFFFFFF], clustering
+
+OUTPUT_COLUMNS = [
+    'visit_id', 'avg_clust', 'avg_dx_clust', 'sum_clust', 'sum_dx_clust',
+    'team_size', 'potential_edges', 'team_edge_size', 'experience', 'dx_experience',
+    'cumulative_experience', 'cumulative_dx_experience',
+    'avg_cumulative_experience', 'avg_cumulative_dx_experience',
+    'gen_count', 'guessed_gen_count', 'fem_count', 'guessed_fem_count',
+    'guessed_gender_ratio', 'gender_ratio',
+]
+
+# output columns that depend on the teamwork window
+WINDOW_COLUMNS = [
+    'avg_clust', 'avg_dx_clust', 'sum_clust', 'sum_dx_clust', 'team_edge_size',
+    'experience', 'dx_experience', 'cumulative_experience', 'cumulative_dx_experience',
+    'avg_cumulative_experience', 'avg_cumulative_dx_experience',
+]
+
+# output columns of a condition, with the condition prefix in place of {}
+CONDITION_COLUMNS = [
+    'avg_{}clust', 'sum_{}clust', '{}experience',
+    'cumulative_{}experience', 'avg_cumulative_{}experience',
+]
+
+# max number of adjacency matrix entries in a batch of get_batch_clustering
+CLUSTERING_BATCH_SIZE = 2**22
@@ -1,7 +1,10 @@
 import pytest
+import pickle
 from teamwork import teamwork as tw
-from utils import utils as u
+from teamwork import synthetic
 import pandas as pd
+import numpy as np
+import networkx as nx
 
 
 def test_team_size():
@@ -32,6 +35,514 @@ def test_edge_size():
     expected_edgesize = 6
     expected_edgesize == actual_edgesize
 
+def test_edge_weight():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df)
+    graph = corpus.team_experience_dict[test_visit_id]['graph']
+    dx_graph = corpus.team_experience_dict[test_visit_id]['dx_graph']
+
+    # Assert
+    assert graph['Albert Romero']['Margie Meyer']['weight'] == 2
+    assert dx_graph['Albert Romero']['Margie Meyer']['weight'] == 1
+    assert graph.number_of_edges() == 3
+
+def test_build_dicts_matches_row_reference():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+
+    # Act
+    (edge_dict, dx_edge_dict, visit_edges_dict, visit_team_dict) = tw._build_dicts_by_row(
+        corpus.edge_df,
+        corpus.team_df,
+        corpus.columns,
+        corpus.authors,
+        corpus.visit_ids,
+        np.datetime64(corpus.FIRST_DATE, "D"),
+    )
+
+    # Assert
+    for expected, actual in [(edge_dict, corpus.edge_to_date_dict),
+                             (dx_edge_dict, corpus.dx_edge_to_date_dict)]:
+        assert expected.keys() == actual.keys()
+        for edge in expected:
+            assert (expected[edge].days == actual[edge].days).all()
+            assert (np.diff(expected[edge].cumcounts) == np.diff(actual[edge].cumcounts)).all()
+    assert visit_team_dict == corpus.visit_id_to_team_dict
+    assert {k: set(v) for k, v in visit_edges_dict.items()} == \
+        {k: set(v) for k, v in corpus.visit_id_to_edges_dict.items()}
+
+def test_edge_keys_do_not_collide():
+    # Arrange: "AB" + "C" and "A" + "BC" concatenate to the same string
+    test_df = pd.DataFrame(
+        [[0, "2019-01-01", "2019-01-01 10:00", "AB", True],
+         [0, "2019-01-01", "2019-01-01 11:00", "C", True],
+         [1, "2019-03-01", "2019-03-01 10:00", "AB", True],
+         [1, "2019-03-01", "2019-03-01 11:00", "C", True],
+         [2, "2019-04-15", "2019-04-15 10:00", "A", True],
+         [2, "2019-04-15", "2019-04-15 11:00", "BC", True]],
+        columns=["id", "arrive_date", "date", "dr", "hf"],
+    )
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df)
+
+    # Assert
+    assert corpus.team_experience_dict[2]['team'] == {"A", "BC"}
+    assert corpus.team_experience_dict[2]['graph'].number_of_edges() == 0
+
+def test_iter_csv_matches_corpus(tmp_path):
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    filename = tmp_path / "notes.csv"
+    test_df.sort_values('date').to_csv(filename, index=False)
+    corpus = tw.TeamworkCorpus(test_df)
+
+    # Act
+    streamed = dict(tw.from_csv(filename, chunksize=2))
+
+    # Assert
+    assert streamed.keys() == corpus.team_experience_dict.keys()
+    for visit_id, item in streamed.items():
+        expected = corpus.team_experience_dict[visit_id]
+        assert item['team'] == expected['team']
+        assert nx.utils.edges_equal(item['graph'].edges(data='weight'),
+                                    expected['graph'].edges(data='weight'))
+
+def test_iter_csv_without_notes(tmp_path):
+    # Arrange
+    filename = tmp_path / "notes.csv"
+    pd.DataFrame(columns=["id", "arrive_date", "date", "dr", "hf"]).to_csv(filename, index=False)
+
+    # Act
+    streamed = list(tw.from_csv(filename, chunksize=2))
+
+    # Assert
+    assert streamed == []
+
+def test_add_notes_matches_full_build():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    is_old = test_df['date'] < '2019-04-16'
+    corpus = tw.TeamworkCorpus(test_df[is_old])
+    full_corpus = tw.TeamworkCorpus(test_df)
+
+    # Act
+    changed_visits = corpus.add_notes(test_df[~is_old])
+
+    # Assert
+    assert changed_visits == [test_visit_id]
+    assert corpus.team_experience_dict.keys() == full_corpus.team_experience_dict.keys()
+    item = corpus.team_experience_dict[test_visit_id]
+    expected = full_corpus.team_experience_dict[test_visit_id]
+    assert item['team'] == expected['team']
+    assert nx.utils.edges_equal(item['graph'].edges(data='weight'),
+                                expected['graph'].edges(data='weight'))
+
+def test_team_experience_is_lazy():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df, cache_size=1)
+    cached_before = len(corpus.team_experience_dict.cache)
+    item = corpus.team_experience_dict[test_visit_id]
+    materialized = corpus.materialize_team_experience()
+
+    # Assert
+    assert cached_before == 0
+    assert corpus.team_experience_dict[test_visit_id] is item
+    assert materialized.keys() == corpus.team_experience_dict.keys()
+    assert materialized[test_visit_id]['team'] == item['team']
+
+def test_parallel_matches_serial():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df, n_jobs=2)
+
+    # Act
+    parallel = corpus.materialize_team_experience()
+    serial = corpus.materialize_team_experience(n_jobs=1)
+
+    # Assert
+    assert parallel.keys() == serial.keys()
+    for visit_id in serial:
+        assert parallel[visit_id]['team'] == serial[visit_id]['team']
+        pd.testing.assert_frame_equal(parallel[visit_id]['edgelist'],
+                                      serial[visit_id]['edgelist'])
+
+def test_save_and_load(tmp_path):
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+
+    # Act
+    corpus.save(tmp_path / "index")
+    loaded = tw.TeamworkCorpus.load(tmp_path / "index")
+
+    # Assert
+    assert loaded.FIRST_DATE == corpus.FIRST_DATE
+    assert loaded.visit_id_to_team_dict == corpus.visit_id_to_team_dict
+    item = loaded.team_experience_dict[test_visit_id]
+    expected = corpus.team_experience_dict[test_visit_id]
+    assert nx.utils.edges_equal(item['graph'].edges(data='weight'),
+                                expected['graph'].edges(data='weight'))
+    assert nx.utils.edges_equal(item['dx_graph'].edges(data='weight'),
+                                expected['dx_graph'].edges(data='weight'))
+
+def test_load_is_faster_than_build(tmp_path):
+    # Arrange
+    notes_df = synthetic.generate_notes(3000, n_authors=500, seed=0)
+    corpus = tw.TeamworkCorpus(notes_df, verbose=False)
+    corpus.save(tmp_path / "index")
+
+    # Act
+    loaded = tw.TeamworkCorpus.load(tmp_path / "index", verbose=False)
+
+    # Assert
+    assert loaded.stats['load'].seconds < sum(s.seconds for s in corpus.stats.values())
+    assert [*loaded.visit_id_to_edges_dict] == [*corpus.visit_id_to_edges_dict]
+    for visit_id in [*corpus.visit_id_to_edges_dict][:50]:
+        assert loaded.visit_id_to_edges_dict[visit_id] == corpus.visit_id_to_edges_dict[visit_id]
+        for (edge, _, _) in corpus.visit_id_to_edges_dict[visit_id]:
+            assert (edge in loaded.edge_to_date_dict) == (edge in corpus.edge_to_date_dict)
+            if edge in corpus.edge_to_date_dict:
+                expected = corpus.edge_to_date_dict[edge]
+                assert (loaded.edge_to_date_dict[edge].days == expected.days).all()
+
+def test_adjacency_graphs():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df.copy(), graph_type="adjacency")
+    nx_corpus = tw.TeamworkCorpus(test_df.copy())
+    item = corpus.team_experience_dict[test_visit_id]
+    expected = nx_corpus.team_experience_dict[test_visit_id]
+
+    # Assert
+    assert isinstance(item['graph'], tw.TeamGraph)
+    assert item['graph'].number_of_edges() == expected['graph'].number_of_edges()
+    assert item['graph'].size(weight='weight') == expected['graph'].size(weight='weight')
+    assert nx.utils.edges_equal(item['graph'].to_networkx().edges(data='weight'),
+                                expected['graph'].edges(data='weight'))
+    assert item['dx_edgelist'] == [*expected['dx_edgelist'].itertuples(index=False, name=None)]
+
+def test_stage_stats(capsys):
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    recorded = []
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df, verbose=False, on_stage=recorded.append)
+    corpus.materialize_team_experience()
+
+    # Assert
+    stages = ['prepare', 'edge join', 'team join', 'dict build', 'experience build']
+    assert [s.stage for s in recorded] == stages
+    assert [*corpus.stats] == stages
+    assert corpus.stats['edge join'].rows == len(corpus.edge_df)
+    assert corpus.stats['experience build'].rows == len(corpus.visit_id_to_edges_dict)
+    assert all(s.seconds >= 0 for s in recorded)
+    assert capsys.readouterr().out == ''
+
+def test_slim():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df.copy())
+
+    # Act
+    slim_corpus = tw.TeamworkCorpus(test_df.copy(), slim=True)
+    before = corpus.memory_usage()
+    after = slim_corpus.memory_usage()
+
+    # Assert
+    assert corpus.notes_df['dr'].dtype == 'category'
+    assert corpus.notes_df[tw.AUTHOR_CODE].dtype == np.int32
+    assert corpus.notes_df[tw.NORM_NOTE_DATE].dtype == np.int32
+    assert slim_corpus.notes_df is None and after['edge_df'] == 0
+    assert after.sum() < before.sum()
+    graph = corpus.team_experience_dict[test_visit_id]['graph']
+    slim_graph = slim_corpus.team_experience_dict[test_visit_id]['graph']
+    assert nx.utils.edges_equal(graph.edges(data=True), slim_graph.edges(data=True))
+    with pytest.raises(ValueError):
+        slim_corpus.add_notes(test_df)
+
+@pytest.mark.parametrize('engine', ['polars', 'duckdb'])
+def test_engine_matches_pandas(engine):
+    # Arrange
+    pytest.importorskip(engine)
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    expected = tw.TeamworkCorpus(test_df.copy())
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df.copy(), engine=engine)
+
+    # Assert
+    for name in ['edge_df', 'team_df']:
+        pd.testing.assert_frame_equal(
+            getattr(corpus, name).reset_index(drop=True),
+            getattr(expected, name).reset_index(drop=True),
+        )
+    assert corpus.visit_id_to_edges_dict == expected.visit_id_to_edges_dict
+    assert corpus.visit_id_to_team_dict == expected.visit_id_to_team_dict
+    pd.testing.assert_frame_equal(corpus.team_edges_df(), expected.team_edges_df())
+
+def test_unknown_engine():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        tw.TeamworkCorpus(test_df, engine='spark')
+
+def test_duplicate_teamwork_windows():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        tw.TeamworkCorpus(test_df, teamwork_window=[90, 90])
+
+def test_conditions():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    test_df['dx'] = np.where(test_df['hf'], 'hf', None)
+
+    # Act
+    corpus = tw.TeamworkCorpus(test_df.copy(), conditions=['hf'])
+    dx_corpus = tw.TeamworkCorpus(test_df.copy(), conditions='dx')
+    item = corpus.team_experience_dict[test_visit_id]
+    dx_item = dx_corpus.team_experience_dict[test_visit_id]
+    edges_df = corpus.team_edges_df()
+
+    # Assert
+    assert dx_corpus.conditions == ['hf']
+    assert nx.utils.edges_equal(item['condition_graphs']['hf'].edges(data='weight'),
+                                item['dx_graph'].edges(data='weight'))
+    assert nx.utils.edges_equal(dx_item['condition_graphs']['hf'].edges(data='weight'),
+                                item['dx_graph'].edges(data='weight'))
+    assert (edges_df['hf_weight'] == edges_df['dx_weight']).all()
+
+def test_parquet(tmp_path):
+    # Arrange
+    pytest.importorskip("pyarrow")
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    test_df['arrive_date'] = pd.to_datetime(test_df['arrive_date'])
+    test_df.to_parquet(tmp_path / "notes.parquet")
+    corpus = tw.TeamworkCorpus(test_df.assign(date=pd.to_datetime(test_df['date'])))
+
+    # Act
+    parquet_corpus = tw.from_parquet(tmp_path / "notes.parquet")
+    parquet_corpus.team_edges_to_parquet(tmp_path / "edges")
+    edges_df = pd.read_parquet(tmp_path / "edges")
+
+    # Assert
+    expected = corpus.team_edges_df()
+    assert parquet_corpus.team_edges_df().equals(expected)
+    assert sorted(edges_df.columns) == sorted([*expected.columns, 'admit_month'])
+    assert len(edges_df) == len(expected)
+    assert edges_df['weight'].sum() == expected['weight'].sum()
+    assert (tmp_path / "edges" / "admit_month=2019-04").is_dir()
+
+def test_readers_pass_corpus_options(tmp_path, capsys):
+    # Arrange
+    pa = pytest.importorskip("pyarrow")
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    test_df['dx'] = np.where(test_df['hf'], 'hf', None)
+    test_df.to_parquet(tmp_path / "notes.parquet")
+    test_df.to_csv(tmp_path / "notes.csv", index=False)
+    options = dict(conditions='dx', verbose=False, graph_type='adjacency', slim=True)
+    corpus = tw.TeamworkCorpus(test_df.copy(), **options)
+
+    # Act
+    corpora = [
+        tw.from_parquet(tmp_path / "notes.parquet", **options),
+        tw.from_arrow(pa.Table.from_pandas(test_df), **options),
+        tw.from_csv(tmp_path / "notes.csv", **options),
+    ]
+
+    # Assert
+    assert capsys.readouterr().out == ""
+    for read_corpus in corpora:
+        assert read_corpus.columns == corpus.columns
+        assert read_corpus.conditions == ['hf']
+        assert read_corpus.graph_type == 'adjacency' and read_corpus.notes_df is None
+        assert read_corpus.team_edges_df().equals(corpus.team_edges_df())
+    with pytest.raises(ValueError):
+        tw.from_csv(tmp_path / "notes.csv", chunksize=2, conditions='dx')
+
+def test_pickle_round_trip():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+
+    # Act
+    unpickled = pickle.loads(pickle.dumps(corpus))
+
+    # Assert
+    pd.testing.assert_frame_equal(
+        unpickled.team_experience_dict[test_visit_id]['edgelist'],
+        corpus.team_experience_dict[test_visit_id]['edgelist'],
+    )
+
+def test_network():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    note_days = corpus.FIRST_DATE.normalize() + pd.to_timedelta(corpus.edge_df[tw.NORM_NOTE_DATE], unit="D")
+
+    # Act
+    edges_df = corpus.network_edges("2019-01-01", "2019-04-01")
+    graph = corpus.network("2019-01-01", "2019-04-01")
+    series = list(corpus.iter_network_edges("2019-02-01", "2019-09-01", window=60))
+
+    # Assert
+    in_window = (note_days >= "2019-01-01") & (note_days < "2019-04-01")
+    assert edges_df['weight'].sum() == in_window.sum()
+    assert graph.size(weight='weight') == in_window.sum()
+    assert len(series) == 8
+    for (date, window_df) in series:
+        assert window_df.equals(
+            corpus.network_edges(date - pd.Timedelta(days=60), date)
+        )
+
+def test_partners():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    edge_df = corpus.edge_df
+    note_days = corpus.FIRST_DATE.normalize() + pd.to_timedelta(edge_df[tw.NORM_NOTE_DATE], unit="D")
+    date = pd.Timestamp("2019-04-15")
+
+    # Act
+    partners = {author: corpus.partners(author, date) for author in corpus.authors}
+    experience = corpus.author_experience(corpus.authors, date)
+
+    # Assert
+    in_window = (note_days >= date - pd.Timedelta(days=90)) & (note_days < date)
+    for (code, author) in enumerate(corpus.authors):
+        is_author = (edge_df[tw.AUTHOR_CODE_X] == code) | (edge_df[tw.AUTHOR_CODE_Y] == code)
+        assert partners[author]['weight'].sum() == (is_author & in_window).sum()
+        assert author not in set(partners[author]['partner'])
+    assert experience['experience'].tolist() == [p['weight'].sum() for p in partners.values()]
+    assert experience['partners'].tolist() == [len(p) for p in partners.values()]
+    with pytest.raises(KeyError):
+        corpus.partners("Dr Nobody", date)
+
+def test_score_team():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    item = corpus.team_experience_dict[test_visit_id]
+    admit_date = corpus.visit_id_to_edges_dict[test_visit_id][0][2]
+    team = [*item['team']]
+
+    # Act
+    score = corpus.score_team(team + ['New Hire'], admit_date)
+    (scores_df, edges_df) = corpus.score_teams([team, team[:1], []], admit_date)
+
+    # Assert
+    assert sorted(score['edgelist']) == sorted(map(tuple, item['edgelist'].values.tolist()))
+    assert sorted(score['dx_edgelist']) == sorted(map(tuple, item['dx_edgelist'].values.tolist()))
+    assert score['team_size'] == len(team) + 1
+    assert score['experience'] == item['edgelist']['weight'].sum()
+    assert scores_df['team_size'].tolist() == [len(team), 1, 0]
+    assert scores_df['experience'].tolist() == [score['experience'], 0, 0]
+    assert (edges_df['team'] == 0).all()
+    assert edges_df['weight'].sum() == score['experience']
+
+def test_build_sharded():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df.copy())
+
+    # Act
+    team_experience = tw.build_sharded(test_df.copy())
+
+    # Assert
+    assert team_experience.keys() == corpus.team_experience_dict.keys()
+    for (visit, item) in team_experience.items():
+        expected = corpus.team_experience_dict[visit]
+        assert item['team'] == expected['team']
+        assert nx.utils.edges_equal(item['graph'].edges(data='weight'),
+                                    expected['graph'].edges(data='weight'))
+        assert nx.utils.edges_equal(item['dx_graph'].edges(data='weight'),
+                                    expected['dx_graph'].edges(data='weight'))
+
+def test_build_sharded_with_missing_shards():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    visit_ids = test_df['id'].unique()
+    facilities = {visit: None if i % 3 == 0 else f'F{i % 2}' for i, visit in enumerate(visit_ids)}
+    test_df['facility'] = test_df['id'].map(facilities)
+    corpus = tw.TeamworkCorpus(test_df.copy())
+
+    # Act
+    visit_shards = tw.get_visit_shards(test_df, shard_by='facility')
+    team_experience = tw.build_sharded(test_df.copy(), shard_by='facility')
+
+    # Assert
+    assert visit_shards.isna().sum() == sum(f is None for f in facilities.values())
+    assert team_experience.keys() == corpus.team_experience_dict.keys()
+
+def test_pair_indices():
+    # Arrange
+    groups = np.array([0, 0, 0, 1, 2, 2])
+
+    # Act
+    (i, j) = tw._pair_indices(groups)
+
+    # Assert
+    assert [*zip(i, j)] == [(0, 1), (0, 2), (1, 2), (4, 5)]
+
 test_visit_id = 6
 
 data = {
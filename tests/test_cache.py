@@ -0,0 +1,122 @@
+import pytest
+from teamwork import teamwork as tw
+from teamwork import cache
+from tests.test_TeamworkCorpus import data_hf, test_visit_id
+import pandas as pd
+import os
+
+
+def get_test_df():
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    return test_df
+
+def test_get_corpus_reuses_cached_corpus(tmp_path):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path)
+    expected = result_cache.get_corpus(get_test_df())
+
+    # Act
+    corpus = result_cache.get_corpus(get_test_df())
+    other_window = result_cache.get_corpus(get_test_df(), teamwork_window=30)
+
+    # Assert
+    assert 'load' not in expected.stats
+    assert 'load' in corpus.stats
+    assert corpus.fingerprint == expected.fingerprint
+    assert 'load' not in other_window.stats
+    assert other_window.fingerprint != corpus.fingerprint
+    pd.testing.assert_frame_equal(
+        corpus.team_experience_dict[test_visit_id]['edgelist'],
+        expected.team_experience_dict[test_visit_id]['edgelist'],
+    )
+
+def test_cache_keys_hold_format_versions(tmp_path, monkeypatch):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path)
+    corpus = result_cache.get_corpus(get_test_df())
+
+    # Act
+    monkeypatch.setattr(cache, "INDEX_VERSION", cache.INDEX_VERSION + 1)
+    new_index = result_cache.get_corpus(get_test_df())
+    monkeypatch.setattr(cache, "NOTES_VERSION", cache.NOTES_VERSION + 1)
+    new_notes = result_cache.get_corpus(get_test_df())
+
+    # Assert
+    assert 'load' not in new_index.stats and 'load' not in new_notes.stats
+    assert len({corpus.fingerprint, new_index.fingerprint, new_notes.fingerprint}) == 3
+
+def test_get_corpus_from_file(tmp_path):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path / 'cache')
+    filename = tmp_path / 'notes.csv'
+    get_test_df().to_csv(filename, index=False)
+    expected = result_cache.get_corpus(filename)
+
+    # Act
+    corpus = result_cache.get_corpus(filename)
+    get_test_df().iloc[:-1].to_csv(filename, index=False)
+    changed = result_cache.get_corpus(filename)
+
+    # Assert
+    assert 'load' in corpus.stats
+    assert 'load' not in changed.stats
+    assert changed.fingerprint != expected.fingerprint
+    assert len([n for n in os.listdir(tmp_path / 'cache') if n.startswith('notes-')]) == 2
+
+def test_get_output_df(tmp_path):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path)
+    corpus = result_cache.get_corpus(get_test_df())
+    prov_demo_dict = {prov: {"sex": "U", "guessed_sex": "U"} for prov in corpus.authors}
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in corpus.visit_ids}
+    expected = result_cache.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+    # Act
+    actual = result_cache.get_output_df(
+        result_cache.get_corpus(get_test_df()), dept_dict, prov_demo_dict
+    )
+
+    # Assert
+    pd.testing.assert_frame_equal(expected, actual)
+    with pytest.raises(ValueError):
+        result_cache.get_output_df(tw.TeamworkCorpus(get_test_df()), dept_dict, prov_demo_dict)
+
+def test_get_output_df_after_add_notes(tmp_path):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path)
+    test_df = get_test_df()
+    old_df = test_df[test_df['date'] < "2019-04-01"]
+    corpus = result_cache.get_corpus(old_df.copy())
+    prov_demo_dict = {prov: {"sex": "U", "guessed_sex": "U"} for prov in test_df['dr']}
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in test_df['id']}
+    result_cache.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+    # Act
+    corpus.add_notes(test_df[test_df['date'] >= "2019-04-01"])
+
+    # Assert
+    assert corpus.fingerprint is None
+    with pytest.raises(ValueError):
+        result_cache.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+def test_eviction_and_invalidation(tmp_path):
+    # Arrange
+    result_cache = cache.ResultCache(tmp_path, max_bytes=1)
+
+    # Act
+    result_cache.get_corpus(get_test_df())
+    latest = result_cache.get_corpus(get_test_df(), teamwork_window=30)
+    entries = os.listdir(tmp_path)
+    result_cache.invalidate('corpus')
+
+    # Assert
+    assert entries == [f'corpus-{latest.fingerprint}']
+    assert result_cache.size() == 0
+    assert 'load' not in result_cache.get_corpus(get_test_df(), teamwork_window=30).stats
+
+
+# Executing the tests in the above test case class
+if __name__ == "__main__":
+    pytest.main()
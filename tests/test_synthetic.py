@@ -0,0 +1,24 @@
+import pytest
+from teamwork import teamwork as tw
+from teamwork import synthetic
+import pandas as pd
+
+
+def test_generate_notes():
+    # Act
+    notes_df = synthetic.generate_notes(n_visits=200, n_authors=30, seed=1)
+    corpus = tw.TeamworkCorpus(notes_df.copy())
+
+    # Assert
+    assert list(notes_df.columns) == list(tw.default_columns.values())
+    assert notes_df['id'].nunique() == 200
+    assert notes_df['dr'].nunique() <= 30
+    assert (notes_df['date'] >= notes_df['arrive_date']).all()
+    assert notes_df['date'].is_monotonic_increasing
+    assert len(corpus.team_experience_dict) > 0
+    pd.testing.assert_frame_equal(notes_df, synthetic.generate_notes(n_visits=200, n_authors=30, seed=1))
+
+
+# Executing the tests in the above test case class
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,160 @@
+import pytest
+from teamwork import teamwork as tw
+from teamwork import teamwork_utils as tu
+from tests.test_TeamworkCorpus import data_hf
+import pandas as pd
+import numpy as np
+import networkx as nx
+
+
+def test_output_df_matches_output_for_row():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    prov_demo_dict = {
+        prov: {"sex": sex, "guessed_sex": "F" if sex == "U" else sex}
+        for prov, sex in zip(corpus.authors, ["F", "M", "U", "M", "F", "U", "F"])
+    }
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in corpus.visit_ids}
+
+    # Act
+    expected = tu.get_outputs(corpus, dept_dict, prov_demo_dict)
+    actual = tu.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+    # Assert
+    # get_output_for_row gives an int 0 for the clustering sum of an empty graph
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+def test_output_df_with_team_members_only_in_prov_demo_dict():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    members = set().union(*corpus.visit_id_to_team_dict.values())
+    prov_demo_dict = {
+        prov: {"sex": "F", "guessed_sex": "M"} for prov in corpus.authors if prov in members
+    }
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in corpus.visit_ids}
+
+    # Act
+    expected = tu.get_outputs(corpus, dept_dict, prov_demo_dict)
+    actual = tu.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+    # Assert
+    assert len(prov_demo_dict) < len(corpus.authors)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+def test_output_df_with_several_windows():
+    # Arrange
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df.copy(), teamwork_window=[90, 30])
+    single_corpus = tw.TeamworkCorpus(test_df.copy())
+    prov_demo_dict = {prov: {"sex": "U", "guessed_sex": "U"} for prov in corpus.authors}
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in corpus.visit_ids}
+
+    # Act
+    expected = tu.get_outputs(corpus, dept_dict, prov_demo_dict)
+    actual = tu.get_output_df(corpus, dept_dict, prov_demo_dict)
+    single = tu.get_output_df(single_corpus, dept_dict, prov_demo_dict)
+
+    # Assert
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+    assert [f'{col}_30' for col in tu.WINDOW_COLUMNS] == [*actual.columns[-11:]]
+    pd.testing.assert_frame_equal(actual[single.columns], single)
+    pd.testing.assert_series_equal(
+        actual['experience_90'], single['experience'], check_names=False
+    )
+    assert (actual['experience_30'] <= actual['experience_90']).all()
+
+def test_output_to_parquet(tmp_path):
+    # Arrange
+    pytest.importorskip("pyarrow")
+    test_df = pd.DataFrame.from_dict(data_hf, orient="index")
+    for col in ['date', 'arrive_date']:
+        test_df[col] = pd.to_datetime(test_df[col])
+    corpus = tw.TeamworkCorpus(test_df)
+    prov_demo_dict = {prov: {"sex": "U", "guessed_sex": "U"} for prov in corpus.authors}
+    dept_dict = {int(visit_id): {"dept": "ICU"} for visit_id in corpus.visit_ids}
+    output_df = tu.get_output_df(corpus, dept_dict, prov_demo_dict)
+
+    # Act
+    tu.output_to_parquet(output_df, corpus, tmp_path / "outputs")
+    actual = pd.read_parquet(tmp_path / "outputs")
+
+    # Assert
+    assert len(actual) == len(output_df)
+    assert set(actual['visit_id']) == set(output_df['visit_id'])
+    assert set(actual['admit_month'].astype(str)) == {'2019-04'}
+
+def test_prov_demo_dict(tmp_path):
+    # Arrange
+    prov_demo_df = pd.DataFrame({
+        "author_prov_id": [1, 2, 3, 4, 5],
+        "prov_name": ["Smith, Mary", "John Doe", "Zzyx Qwv", "Jones, John", "Lee, Mary"],
+        "sex": [None, "U", None, "F", None],
+        "clinician_title": ["MD", None, "RN", "MD", "NP"],
+    })
+    prov_demo_df.to_csv(tmp_path / "prov.csv", index=False)
+    cache_filename = tmp_path / "prov.pkl"
+
+    # Act
+    prov_demo_dict = tu.get_prov_demo_dict(tmp_path / "prov.csv", cache_filename)
+    cached_dict = tu.get_prov_demo_dict(tmp_path / "prov.csv", cache_filename)
+    prov_demo_df.iloc[:1].to_csv(tmp_path / "prov.csv", index=False)
+    changed_dict = tu.get_prov_demo_dict(tmp_path / "prov.csv", cache_filename)
+
+    # Assert
+    assert [prov_demo_dict[i]["guessed_sex"] for i in range(1, 6)] == ["F", "M", "U", "F", "F"]
+    assert prov_demo_dict[2]["clinician_title"] == "UNKNOWN"
+    expected = prov_demo_df.assign(
+        sex=prov_demo_df["sex"].fillna("U"),
+        clinician_title=prov_demo_df["clinician_title"].fillna("UNKNOWN"),
+    )
+    expected["guessed_sex"] = expected.apply(tu.get_gender_for_row, axis="columns")
+    assert prov_demo_dict == expected.set_index("author_prov_id").to_dict("index")
+    assert cached_dict == prov_demo_dict
+    assert [*changed_dict] == [1]
+
+def test_batch_clustering_matches_networkx():
+    # Arrange
+    graphs = {
+        0: nx.complete_graph(['a', 'b', 'c', 'd']),
+        3: nx.cycle_graph(['a', 'b', 'c']),
+        5: nx.path_graph(['e', 'f']),
+        9: nx.gnp_random_graph(12, 0.5, seed=1),
+    }
+    edges = [
+        (code, u, v, float(1 + (i * 7) % 11))
+        for code, g in graphs.items()
+        for i, (u, v) in enumerate(g.edges())
+    ]
+    for code, u, v, w in edges:
+        graphs[code][u][v]['weight'] = w
+    graph_codes, sources, targets, weights = zip(*edges)
+
+    # Act
+    (node_graphs, nodes, clustering) = tu.get_batch_clustering(
+        np.array(graph_codes), np.array(sources, dtype=object),
+        np.array(targets, dtype=object), np.array(weights)
+    )
+
+    # Assert
+    actual = {(code, node): c for code, node, c in zip(node_graphs, nodes, clustering)}
+    expected = {
+        (code, node): c
+        for code, g in graphs.items()
+        for node, c in nx.clustering(g, weight='weight').items()
+    }
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key])
+
+
+# Executing the tests in the above test case class
+if __name__ == "__main__":
+    pytest.main()